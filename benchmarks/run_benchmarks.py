@@ -0,0 +1,113 @@
+'''
+Offline benchmarks of the EU-SES pipeline stages on synthetic datasets.
+Run from the repository root, e.g.:
+    python benchmarks/run_benchmarks.py --nuts2 100 --vertices 200 --points 10000 --hours 8760 --output timings.json
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from euses.classification import aggregation
+from euses.demand import hot_water_load, space_heating_load
+from euses.spatial import assign_nuts2
+from euses.model import prepare_model_dir, nuts2_region_index, create_location_yaml, create_timeseries_csv
+from synthetic import synthetic_dataset, synthetic_points, synthetic_hot_water_profile, synthetic_space_heating_profile
+
+template_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'calliope_model')
+
+def measure(func, *args, **kwargs):
+    ''' Return the runtime in seconds and the peak of memory allocated in MB of func(*args, **kwargs) '''
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    runtime = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return runtime, peak / 1e6
+
+def country_groups(ds):
+    country_code = ds['country_code'].values
+    return [list(ds.coords['nuts_2'].values[country_code == c]) for c in np.unique(country_code)]
+
+def regions_dataset(dataset):
+    dataset.create_regions('poli_regions_nuts1')
+    return dataset
+
+def export_model(dataset, function, model_dir):
+    regions_geo = dataset.regions_geo()
+    if function == 'create_location_yaml':
+        create_location_yaml(regions_geo, dataset.ds_regions, ['power','heat','iron and steel'], nuts2_region_index(regions_geo), model_dir)
+    else:
+        create_timeseries_csv(regions_geo, dataset.ds_regions, ['power','heat','iron and steel'], model_dir=model_dir)
+
+def benchmarks(args):
+    dataset = synthetic_dataset(args.nuts2, args.countries, args.vertices, args.hours, seed=args.seed)
+    ds = dataset.ds
+    points = synthetic_points(ds, args.points, args.seed)
+    time_index = pd.DatetimeIndex(ds.coords['time'].values)
+    calendar = pd.DataFrame({'season': (time_index.month.isin([6, 7, 8]) == False).astype(int),
+                             'dayofweek': time_index.dayofweek.map({0:0, 1:0, 2:0, 3:0, 4:0, 5:1, 6:2}),
+                             'hour': time_index.hour.map(lambda h: 24 if h == 0 else h)})
+    hot_water_profile = synthetic_hot_water_profile(args.seed)
+    space_heating_profile = synthetic_space_heating_profile(seed=args.seed)
+    temperature = ds['temperature'].values[0]
+
+    model_dir = tempfile.mkdtemp()
+    prepare_model_dir(model_dir, template_dir)
+    regions = regions_dataset(synthetic_dataset(args.nuts2, args.countries, args.vertices, args.hours, seed=args.seed))
+
+    stages = {
+        'aggregation': lambda: aggregation(ds, country_groups(ds)),
+        'create_regions poli_regions': lambda: dataset.create_regions('poli_regions'),
+        'create_regions poli_regions_nuts1': lambda: dataset.create_regions('poli_regions_nuts1'),
+        'create_regions rdm_regions': lambda: dataset.create_regions('rdm_regions', area_factor=args.area_factor),
+        'create_regions max_p_regions': lambda: dataset.create_regions('max_p_regions', area_factor=args.area_factor),
+        'create_location_yaml': lambda: export_model(regions, 'create_location_yaml', model_dir),
+        'create_timeseries_csv': lambda: export_model(regions, 'create_timeseries_csv', model_dir),
+        'Heat hot_water_load': lambda: hot_water_load(calendar, hot_water_profile, ['season', 'dayofweek', 'hour']),
+        'Heat space_heating_load': lambda: space_heating_load(temperature, time_index.hour.values, space_heating_profile),
+        'assign_nuts2': lambda: assign_nuts2(points, ds),
+    }
+    results = []
+    for name, stage in stages.items():
+        if args.stages and not any(s in name for s in args.stages):
+            continue
+        try:
+            runtimes, peaks = zip(*[measure(stage) for i in range(args.repeat)])
+        except Exception as e:
+            # keep measuring the other stages, e.g. without the spopt version of max_p_regions
+            tracemalloc.stop()
+            results.append({'stage': name, 'error': repr(e)})
+            print('{:<36} failed: {!r}'.format(name, e))
+            continue
+        results.append({'stage': name, 'runtime_s': min(runtimes), 'peak_memory_mb': max(peaks)})
+        print('{:<36} {:>10.3f} s {:>10.1f} MB'.format(name, min(runtimes), max(peaks)))
+    return results
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nuts2', type=int, default=50, help='number of nuts_2 areas')
+    parser.add_argument('--countries', type=int, default=5, help='number of countries')
+    parser.add_argument('--vertices', type=int, default=100, help='number of vertices of each area')
+    parser.add_argument('--points', type=int, default=10000, help='number of points assigned to the areas')
+    parser.add_argument('--hours', type=int, default=8760, help='length of the time dimension')
+    parser.add_argument('--area-factor', type=float, default=2, help='area_factor of the max-p and random regions')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each stage, the fastest is reported')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stages', nargs='*', help='only run the stages whose name contains one of these')
+    parser.add_argument('--output', help='json file where the results are saved')
+    args = parser.parse_args()
+
+    results = benchmarks(args)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'parameters': vars(args), 'results': results}, f, indent=2)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import xarray as xr
+from shapely.geometry import Polygon, Point
+
+from euses import parameters as pr
+from euses.components import EUSES
+
+def synthetic_polygon(x, y, size, vertices):
+    ''' Square of side size with vertices points evenly spaced on its border,
+        neighbouring squares share the points of their common side
+    '''
+    t = np.linspace(0, 4, 4*int(np.ceil(vertices/4)), endpoint=False)
+    side, step = np.divmod(t, 1)
+    px = np.select([side == 0, side == 1, side == 2], [step, 1, 1-step], 0)
+    py = np.select([side == 0, side == 1, side == 2], [0, step, 1], 1-step)
+    return Polygon(zip(x + px*size, y + py*size))
+
+def synthetic_dataset(n_nuts2=50, n_countries=5, vertices=100, hours=8760, year=2010, seed=0):
+    '''
+    Return an EUSES dataset with the variables of a built dataset filled with random values.
+    n_nuts2 : number of nuts_2 areas, on a grid of 100 km squares in epsg:3035
+    n_countries : number of countries, the areas are split in columns of countries
+    vertices : number of vertices of each area
+    hours : length of the time dimension
+    '''
+    rng = np.random.default_rng(seed)
+    nuts_0 = [c.get('nuts_id') for c in pr.countries_metadata() if len(c.get('nuts_id')) == 2 and c.get('nuts_id') != 'GR'][:n_countries]
+    countries = [pr.get_metadata(c, 'name') for c in nuts_0]
+    side = int(np.ceil(np.sqrt(n_nuts2)))
+    size = 1e5
+
+    self = EUSES(countries, year, import_ds=True)
+    ds = xr.Dataset()
+    ds.coords['time'] = pd.date_range(str(year), periods=hours, freq='h')
+    ds.coords['nuts_0'] = nuts_0
+    country_code = np.array([nuts_0[min(i * n_countries // n_nuts2, n_countries-1)] for i in range(n_nuts2)])
+    ds.coords['nuts_2'] = ['{}{:02d}'.format(c, i) for i, c in enumerate(country_code)]
+    ds.coords['tech'] = ['Combined cycle', 'Solar', 'Wind', 'Wind Offshore']
+    ds.coords['fuel'] = ['Natural gas', 'Solar', 'Wind']
+    ds.coords['hydro_tech'] = ['HDAM', 'HPHS', 'HROR']
+    ds.coords['sector'] = ['Iron and steel']
+    ds.coords['e_form'] = ['hydrogen', 'power']
+
+    geometry = [synthetic_polygon(4e6 + (i // side)*size, 2.5e6 + (i % side)*size, size, vertices) for i in range(n_nuts2)]
+    ds['geometry'] = (('nuts_2'), np.array(geometry, dtype=object))
+    ds['geometry'].attrs['crs'] = 'epsg:3035'
+    ds['country_code'] = (('nuts_2'), country_code)
+    ds['population'] = (('nuts_2'), rng.uniform(1e5, 5e6, n_nuts2))
+    ds['temperature'] = (('nuts_0', 'time'), rng.normal(10, 8, (n_countries, hours)))
+
+    for var in ['power', 'heat', 'heat_centralized', 'heat_decentralized', 'pv_cf', 'wind_cf', 'hydro_inflow']:
+        ds[var] = (('nuts_2', 'time'), rng.random((n_nuts2, hours)))
+    ds['wind_offshore_cf'] = (('nuts_0', 'time'), rng.random((n_countries, hours)))
+    ds['cop_air'] = (('nuts_2', 'time'), rng.uniform(2, 4, (n_nuts2, hours)))
+    for var in ['rooftop_pv', 'utility_pv', 'onshore_wind']:
+        ds[var] = (('nuts_2'), rng.uniform(0, 1e3, n_nuts2))
+    ds['offshore_wind'] = (('nuts_2'), rng.uniform(0, 1e3, n_nuts2) * (rng.random(n_nuts2) < 0.3))
+    ds['power_plants'] = (('nuts_2', 'tech', 'fuel'), rng.uniform(0, 1e3, (n_nuts2, 4, 3)))
+    ds['hydro_capacity'] = (('nuts_2', 'hydro_tech'), rng.uniform(0, 1e2, (n_nuts2, 3)))
+    ds['hydro_storage'] = (('nuts_2', 'hydro_tech'), rng.uniform(0, 1e3, (n_nuts2, 3)))
+    ds['industries'] = (('nuts_2', 'sector'), rng.uniform(0, 1e6, (n_nuts2, 1)))
+    ds['industries_demand'] = (('sector', 'e_form', 'nuts_2'), rng.uniform(0, 1e6, (1, 2, n_nuts2)))
+    ds['industries_demand'].attrs['profile'] = 'flat'
+    self.ds = ds
+    return self
+
+def synthetic_points(ds, n_points, seed=0):
+    ''' GeoDataFrame of random points within the bounds of the areas '''
+    rng = np.random.default_rng(seed)
+    x_min, y_min, x_max, y_max = gpd.GeoSeries(ds['geometry'].values).total_bounds
+    points = [Point(x, y) for x, y in zip(rng.uniform(x_min, x_max, n_points), rng.uniform(y_min, y_max, n_points))]
+    return gpd.GeoDataFrame(geometry=points)
+
+def synthetic_hot_water_profile(seed=0):
+    ''' Generic hot water profile of one NUTS2 code, by season, day type and hour '''
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product([[0, 1], [0, 1, 2], range(1, 25)], names=['season', 'day_type', 'hour'])
+    return index.to_frame(index=False).assign(load=rng.random(len(index)))
+
+def synthetic_space_heating_profile(grades=30, seed=0):
+    ''' Generic space heating profile, load by hour and temperature grade '''
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product([range(24), np.linspace(-20, 30, grades)], names=['hour', 'temperature'])
+    return index.to_frame(index=False).assign(load=rng.random(len(index)))
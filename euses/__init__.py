@@ -1,5 +1,8 @@
 
 
 
-from .components import EUSES, import_dataset, build_dataset
+from .components import EUSES, import_dataset, build_dataset, evict_checkpoints
 from .parameters import countries_metadata
+from .utilib import set_cache, clear_cache
+from .precision import set_precision
+from .sweep import scenario_grid, sweep
@@ -2,61 +2,105 @@ import pandas as pd
 import geopandas as gpd
 from shapely.ops import  unary_union
 from shapely.geometry import shape, mapping
-from shapely import wkt
+from scipy import sparse
 import numpy as np
+import xarray as xr
 import spopt, libpysal
+import pickle
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 
-def wind_offshore_to_nuts2(ds):
-    time_range = ds.time.values
-    dsc = ds.copy()
-
-    ds['wind_offshore_cf'] = (('nuts_2','time'),(np.array([[t*0.0 for t in range(len(time_range))]]*len(ds.coords['nuts_2']))))
-
-    ds_c = ds.where(ds['offshore_wind'] > 0, drop = True)
-    for nuts2_id in ds_c.coords['nuts_2'].values:
-        nuts0_id = ds['country_code'].loc[nuts2_id].values.item()
-        ds['wind_offshore_cf'].loc[nuts2_id] = dsc['wind_offshore_cf'].loc[nuts0_id]
-
-
-def aggregation(ds, groups):
-
-    dsc = ds.copy()
-
-    sums_vars = ['power', 'population', 'heat', 'power_plants', 'onshore_wind','offshore_wind',
-                  'rooftop_pv','utility_pv','hydro_capacity', 'hydro_storage','industries','industries_demand']
-    area_weighted_vars = ['wind_cf', 'pv_cf', 'wind_offshore_cf',
-                          'cop_air','hydro_inflow']
+from . import parameters as pr
+from .precision import time_series_zeros
 
+def wind_offshore_to_nuts2(ds):
+    ''' Capacity factor of the offshore wind of each nuts_2 area with offshore potential, from its country '''
+    # the mask is computed first, datasets opened with dask can not be indexed with a lazy boolean array
+    offshore = np.flatnonzero(ds['offshore_wind'].values > 0)
+    nuts_0 = [pr.nuts_id_from_code(c) for c in ds['country_code'].values[offshore]]
+
+    wind_offshore_cf = time_series_zeros(ds, ('nuts_2','time'))
+    wind_offshore_cf[offshore] = ds['wind_offshore_cf'].sel(nuts_0=nuts_0).transpose('nuts_0','time').values
+    ds['wind_offshore_cf'] = (('nuts_2','time'),(wind_offshore_cf))
+
+
+sums_vars = ['power', 'population', 'heat', 'power_plants', 'onshore_wind','offshore_wind',
+              'rooftop_pv','utility_pv','hydro_capacity', 'hydro_storage','industries','industries_demand']
+area_weighted_vars = ['wind_cf', 'pv_cf', 'wind_offshore_cf',
+                      'cop_air','hydro_inflow']
+
+def membership(ds, groups):
+    ''' Return the names, the position of the first member, the sparse nuts_2 -> region
+        membership matrix and a mask of the grouped regions.
+        nuts_2 areas in no group are regions of their own.
+    '''
     sep=','
-    new_coords = dsc.coords['nuts_2'].values
+    nuts_2 = list(ds.coords['nuts_2'].values)
+    position = dict(zip(nuts_2, range(len(nuts_2))))
+    region_of = np.arange(len(nuts_2))
+    names = dict(zip(range(len(nuts_2)), nuts_2))
+    grouped = np.zeros(len(nuts_2), dtype=bool)
     for nuts in groups:
-        if nuts[0] in dsc.coords['nuts_2']:
-            ds_is =  dsc.sel(nuts_2=nuts)
-            group_area = sum([i.area for i in ds_is['geometry'].values])
-            offshore_area_sum = ds_is['offshore_wind'].sum()
-
-            for var in area_weighted_vars:
-                for n in nuts:
-                    if var == 'wind_offshore_cf':
-                        ds_is[var].loc[n] = dsc[var].loc[n] * dsc['offshore_wind'].loc[n] / offshore_area_sum
-                    else:
-                        ds_is[var].loc[n] = dsc[var].loc[n] * dsc['geometry'].loc[n].values.item().area / group_area
-                dsc[var].loc[{'nuts_2':nuts[0]}] = ds_is[var].sum(dim="nuts_2")
-
-            for var in sums_vars:
-                dsc[var].loc[{'nuts_2':nuts[0]}] = ds_is[var].sum(dim="nuts_2")
-
-            dsc['geometry'].loc[{'nuts_2':nuts[0]}] = np.array(str(unary_union(ds_is['geometry'].loc[nuts].values)))
-
-            new_coords = np.where(new_coords==nuts[0], sep.join(nuts), new_coords)
-            dsc = dsc.assign_coords(nuts_2=new_coords)
-            for n in nuts[1:]:
-                new_coords = new_coords[new_coords!=n]
-            dsc = dsc.sel(nuts_2=new_coords)
-
-            for nuts_2_id in dsc.coords['nuts_2']:
-                dsc['geometry'].loc[nuts_2_id] = str(dsc['geometry'].loc[nuts_2_id].values.item())
-            dsc['geometry'] = (('nuts_2'),pd.Series(dsc['geometry']).apply(wkt.loads))
+        if nuts[0] in position:
+            members = [n for n in nuts if n in position]
+            region_of[[position[n] for n in members]] = position[nuts[0]]
+            names[position[nuts[0]]] = sep.join(members)
+            grouped[position[nuts[0]]] = True
+
+    first = np.unique(region_of)
+    rows = np.searchsorted(first, region_of)
+    matrix = sparse.csr_matrix((np.ones(len(nuts_2)), (rows, np.arange(len(nuts_2)))), shape=(len(first), len(nuts_2)))
+    return [names[i] for i in first], first, matrix, grouped[first]
+
+def reduce_nuts2(da, matrix):
+    ''' Contract the nuts_2 dimension of da with the (regions x nuts_2) matrix, in float64 and returned in the dtype of da '''
+    dims = da.dims
+    dtype = da.dtype if np.issubdtype(da.dtype, np.floating) else 'float64'
+    if da.chunks is not None:
+        # dask array, the chunks are reduced lazily with the dense matrix
+        weights = xr.DataArray(matrix.toarray(), dims=('regions', 'nuts_2'))
+        values = xr.dot(weights, da.fillna(0).astype('float64'), dims='nuts_2')
+        return values.rename({'regions': 'nuts_2'}).transpose(*dims).astype(dtype).assign_attrs(da.attrs)
+    da = da.transpose('nuts_2', ...)
+    values = np.nan_to_num(da.values.reshape(da.shape[0], -1).astype('float64'))
+    values = (matrix @ values).reshape((matrix.shape[0],) + da.shape[1:])
+    return xr.DataArray(values.astype(dtype), dims=da.dims, attrs=da.attrs).transpose(*dims)
+
+def normalized_weights(matrix, grouped, weights):
+    ''' Weights of the members of each grouped region, the regions not grouped keep their values '''
+    weighted = matrix.multiply(weights.reshape(1, -1)).tocsr()
+    total = np.asarray(weighted.sum(axis=1)).ravel()
+    scale = np.divide(1.0, total, out=np.zeros_like(total), where=total != 0)
+    return sparse.diags(scale * grouped) @ weighted + sparse.diags((~grouped).astype('float64')) @ matrix
+
+def aggregation(ds, groups):
+    ''' Aggregate the nuts_2 areas of each group, the variables in sums_vars are summed,
+        the variables in area_weighted_vars are averaged with the area (offshore area for wind_offshore_cf)
+        and the other variables take the value of the first area of the group.
+    '''
+    names, first, matrix, grouped = membership(ds, groups)
+
+    dsc = ds.isel(nuts_2=first)
+    area = np.array([g.area for g in ds['geometry'].values])
+    area_weights = normalized_weights(matrix, grouped, area)
+
+    for var in sums_vars:
+        if var in ds.data_vars and 'nuts_2' in ds[var].dims:
+            dsc[var] = reduce_nuts2(ds[var], matrix)
+
+    for var in area_weighted_vars:
+        if var in ds.data_vars and 'nuts_2' in ds[var].dims:
+            if var == 'wind_offshore_cf':
+                weights = normalized_weights(matrix, grouped, np.nan_to_num(ds['offshore_wind'].values.astype('float64')))
+            else:
+                weights = area_weights
+            dsc[var] = reduce_nuts2(ds[var], weights)
+
+    geometry = ds['geometry'].values
+    members = np.split(matrix.indices, matrix.indptr[1:-1])
+    dsc['geometry'] = (('nuts_2'), np.array([geometry[m[0]] if len(m) == 1 else unary_union(list(geometry[m]))
+                                             for m in members], dtype=object))
+    dsc = dsc.assign_coords(nuts_2=names)
 
     return dsc
 
@@ -79,22 +123,77 @@ def round_coord(zones):
             geom['coordinates'] = geom_coord_m
             zones.loc[i,'geometry'] = gpd.GeoDataFrame(geometry=[shape(geom)]).geometry.values
 
-def max_p_regions(zones,feature,area_factor,initial_val):
-    w = libpysal.weights.Queen.from_dataframe(zones)
+_weights_cache = {}
 
-    attrs = feature
+def queen_weights(zones):
+    ''' Queen contiguity weights of the zones, cached by the ids and geometries of the zone set '''
+    key = hashlib.sha256(pickle.dumps((list(zones['id']), [g.wkb for g in zones.geometry]))).hexdigest()
+    if key not in _weights_cache:
+        _weights_cache[key] = libpysal.weights.Queen.from_dataframe(zones)
+    return _weights_cache[key]
+
+def max_p_labels(zones, feature, area_factor, initial_val, w):
     threshold_name = 'minimum_threshold'
     threshold = zones.minimum_threshold.median()*area_factor
 
-    model = spopt.MaxPHeuristic(zones, w, attrs, threshold_name, threshold, top_n=100, max_iterations_construction=initial_val)
+    model = spopt.MaxPHeuristic(zones, w, feature, threshold_name, threshold, top_n=100, max_iterations_construction=initial_val)
     model.solve()
-    zones["maxp_new"] = model.labels_
-    nuts_array = zones["maxp_new"].unique()
-    class_regions = [np.where(zones['maxp_new']==x)[0].tolist() for x in nuts_array]
+    return model.p, np.asarray(model.labels_)
+
+def labels_to_regions(labels):
+    return [np.where(labels==x)[0].tolist() for x in pd.unique(labels)]
 
-    print('Number of regions is {}'.format(model.p))
+def max_p_regions(zones,feature,area_factor,initial_val,w=None):
+    if w is None:
+        w = queen_weights(zones)
 
-    if model.p != 0:
+    p, labels = max_p_labels(zones, feature, area_factor, initial_val, w)
+    zones["maxp_new"] = labels
+    class_regions = labels_to_regions(labels)
+
+    print('Number of regions is {}'.format(p))
+
+    if p != 0:
         return class_regions
     else:
         return False
+
+def heterogeneity(zones, feature, labels):
+    ''' Sum of the squared deviations of the standardized features from the mean of their region '''
+    x = zones[feature].astype('float64')
+    x = (x - x.mean()) / x.std().replace(0, 1)
+    return float(((x - x.groupby(labels).transform('mean'))**2).sum().sum())
+
+# objectives of max_p_search, the run with the lowest value is the best
+max_p_objectives = {'p': lambda run: -run['p'], 'heterogeneity': lambda run: run['heterogeneity']}
+
+def _max_p_run(args):
+    zones, feature, area_factor, initial_val, seed, w = args
+    # the seed sets the random feature of rdm_regions and the random choices of the heuristic
+    np.random.seed(seed)
+    zones = zones.assign(rdm_values=np.random.rand(len(zones.index)))
+    p, labels = max_p_labels(zones, feature, area_factor, initial_val, w)
+    return {'seed': seed, 'area_factor': area_factor, 'p': p,
+            'heterogeneity': heterogeneity(zones, feature, labels), 'labels': labels}
+
+def max_p_search(zones, feature, area_factors, initial_val, seeds, objective='p', max_workers=None):
+    '''
+    Solve the max-p problem for every seed and area_factor on a pool of max_workers processes,
+    the contiguity weights are computed once for the zones.
+    objective : key of max_p_objectives used to select the best run
+    Returns the regions of the best run (False if it has no region) and a DataFrame of all runs
+    '''
+    w = queen_weights(zones)
+    tasks = [(zones, feature, a, initial_val, seed, w) for a in area_factors for seed in seeds]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        runs = list(executor.map(_max_p_run, tasks))
+
+    runs = pd.DataFrame(runs)
+    runs['objective'] = [max_p_objectives[objective](run) for run in runs.to_dict('records')]
+    best = runs.loc[runs['objective'].idxmin()]
+    print('Number of regions is {} (seed {}, area_factor {})'.format(best['p'], best['seed'], best['area_factor']))
+
+    if best['p'] != 0:
+        return labels_to_regions(best['labels']), runs
+    else:
+        return False, runs
@@ -3,112 +3,205 @@ import pandas as pd
 import geopandas as gpd
 import numpy as np
 import xarray as xr
-from rasterstats import zonal_stats
-from shapely import wkt
 import copy
-import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import tempfile
-from io import BytesIO
+import shutil
+import json
+import hashlib
+import inspect
+import time
 from zipfile import ZipFile
-from urllib.request import urlopen
 from shapely.ops import transform
 import os
 
 from . import parameters as pr
-from .utilib import download_re_ninja
+from .utilib import download_re_ninja_batch, fetch_path
+from .instrumentation import Report, span
+from .precision import time_series_array, time_series_vars, int16_encoding, precision
+from .spatial import zonal_stats_batch, encode_geometry, decode_geometry
 from .demand import Power, Heat, Iron_and_Steel
 from .renewables import Heat_Pumps, VRE_Capacity_Factor, Hydro, Area
 from .resources import Power_Plants
-from .classification import wind_offshore_to_nuts2, aggregation, round_coord, max_p_regions
-from .model import create_location_yaml, create_timeseries_csv, create_model_yaml
+from .classification import wind_offshore_to_nuts2, aggregation, round_coord, max_p_regions, max_p_search
+from .model import prepare_model_dir, nuts2_region_index, create_location_yaml, create_timeseries_csv, create_model_yaml, create_timeseries, create_model_dict, dataframe_references
+
+# chunk sizes of saved datasets, one month of hourly values for groups of nuts_2 areas
+dataset_chunks = {'nuts_2': 64, 'time': 744}
+# version of the regions saved in checkpoint_dir, to change when create_regions gives different regions
+regions_version = 1
 
 class EUSES():
 
-    def __init__(self,countries,year,import_ds=False):
+    def __init__(self,countries,year,import_ds=False,checkpoint_dir=None):
         '''
         countries : List of countries by name
         year : reference year
+        checkpoint_dir : folder where the variables written by each component are saved,
+                         a component is only run again if its version, kwargs or inputs changed.
+                         The regions of create_regions are saved there too, see evict_checkpoints
         '''
 
         self.ds = xr.Dataset()
         self.countries = countries
         self.year = year
+        self.checkpoint_dir = checkpoint_dir
+        self.report = Report()
 
         if import_ds == False:
-
-            nuts_geom_eu = gpd.read_file('https://gisco-services.ec.europa.eu/distribution/v2/nuts/geojson/NUTS_RG_10M_2013_3035_LEVL_2.geojson')
-
-            time = pd.date_range(str(year), str(year+1), freq='1H')[:-1]
-            self.ds.coords['time'] = time
-            self.ds.coords['nuts_0'] = [pr.get_metadata(c,'nuts_id') for c in self.countries]
-
-            nuts_2 = gpd.GeoDataFrame()
-            for c in self.countries:
-                nuts_id = pr.get_metadata(c,'nuts_id')
-                if nuts_id == 'GR':
-                    nuts_geom = nuts_geom_eu.loc[nuts_geom_eu['id'].str.contains('EL')]
-                elif nuts_id == 'GB':
-                    nuts_geom = nuts_geom_eu.loc[nuts_geom_eu['id'].str.contains('UK')]
-                else:
-                    nuts_geom = nuts_geom_eu.loc[nuts_geom_eu['id'].str.contains(nuts_id)]
-
-                nuts_2 = gpd.GeoDataFrame(pd.concat([nuts_geom, nuts_2]))
-
-            nuts_2.crs = {'init': 'epsg:3035'}
-            # remove islands from nuts zones
-            islands = ['FRA','FR83','PT20','PT30','ES53','ES63','ES64','ES70',
-                                'EL30','EL41','EL65','EL43','EL62','EL42']
-            for id in islands:
-                nuts_2 = nuts_2.loc[nuts_2['id'].str.contains(id)==False]
-
-            self.ds.coords['nuts_2'] = (('nuts_2'), nuts_2['NUTS_ID'])
-            self.ds['country_code'] = ('nuts_2'),(nuts_2['CNTR_CODE'].to_xarray().astype('str'))
-            self.ds['geometry'] = (('nuts_2'),(nuts_2['geometry'].to_xarray()))
-            self.ds['geometry_54009'] = (('nuts_2'),(nuts_2['geometry'].to_crs({'proj': 'moll'}).to_xarray()))
-            self.ds['geometry'].attrs['crs'] = 'epsg:3035'
-
-            # add population data
-            if ['population'] not in list(self.ds.keys()):
-                temp = tempfile.TemporaryDirectory()
-                resp = urlopen("http://cidportal.jrc.ec.europa.eu/ftp/jrc-opendata/GHSL/GHS_POP_GPW4_GLOBE_R2015A/GHS_POP_GPW42015_GLOBE_R2015A_54009_1k/V1-0/GHS_POP_GPW42015_GLOBE_R2015A_54009_1k_v1_0.zip")
-                zipfile = ZipFile(BytesIO(resp.read()))
-                raster_path = temp.name+'/GHS_POP_GPW42015_GLOBE_R2015A_54009_1k_v1_0.tif'
-                open(raster_path, 'wb').write(zipfile.read(zipfile.namelist()[3]))
-                population_data = []
-                for l in  self.ds.coords['nuts_2']:
-                    geo = self.ds.sel(nuts_2=l)['geometry_54009'].values.item()
-                    population = zonal_stats(geo, raster_path, stats='sum')[0].get('sum')
-                    population_data.append(population)
-
-                self.ds['population'] = (('nuts_2'),(np.array(population_data)))
-                self.ds['population'].attrs['unit'] = 'People'
-                self.ds = self.ds.drop('geometry_54009')
-                temp.cleanup()
-
-            # add temperature data
-            temperature_data = []
-            for c in self.countries:
-                re_id = pr.get_metadata(c,'renewables_nj_id')
-                weather = download_re_ninja(year,re_id,'weather')
-                temperature_data.append(weather['temperature'].to_list())
-            self.ds['temperature'] =  (('nuts_0','time'),(np.array(temperature_data)))
-            self.ds['temperature'].attrs['unit'] = 'Degrees Celsius'
+            with span('EUSES', report=self.report, dataset=self):
+
+                nuts_geom_eu = gpd.read_file(fetch_path('https://gisco-services.ec.europa.eu/distribution/v2/nuts/geojson/NUTS_RG_10M_2013_3035_LEVL_2.geojson'))
+
+                time = pd.date_range(str(year), str(year+1), freq='1H')[:-1]
+                self.ds.coords['time'] = time
+                self.ds.coords['nuts_0'] = [pr.get_metadata(c,'nuts_id') for c in self.countries]
+
+                nuts_2 = gpd.GeoDataFrame()
+                for c in self.countries:
+                    nuts_geom = nuts_geom_eu.loc[nuts_geom_eu['CNTR_CODE'] == pr.source_id(c,'nuts')]
+
+                    nuts_2 = gpd.GeoDataFrame(pd.concat([nuts_geom, nuts_2]))
+
+                nuts_2.crs = {'init': 'epsg:3035'}
+                # remove islands from nuts zones
+                islands = ['FRA','FR83','PT20','PT30','ES53','ES63','ES64','ES70',
+                                    'EL30','EL41','EL65','EL43','EL62','EL42']
+                for id in islands:
+                    nuts_2 = nuts_2.loc[nuts_2['id'].str.contains(id)==False]
+
+                self.ds.coords['nuts_2'] = (('nuts_2'), nuts_2['NUTS_ID'])
+                self.ds['country_code'] = ('nuts_2'),(nuts_2['CNTR_CODE'].to_xarray().astype('str'))
+                self.ds['geometry'] = (('nuts_2'),(nuts_2['geometry'].to_xarray()))
+                self.ds['geometry_54009'] = (('nuts_2'),(nuts_2['geometry'].to_crs({'proj': 'moll'}).to_xarray()))
+                self.ds['geometry'].attrs['crs'] = 'epsg:3035'
+
+                # add population data
+                if ['population'] not in list(self.ds.keys()):
+                    temp = tempfile.TemporaryDirectory()
+                    zipfile = ZipFile(fetch_path("http://cidportal.jrc.ec.europa.eu/ftp/jrc-opendata/GHSL/GHS_POP_GPW4_GLOBE_R2015A/GHS_POP_GPW42015_GLOBE_R2015A_54009_1k/V1-0/GHS_POP_GPW42015_GLOBE_R2015A_54009_1k_v1_0.zip"))
+                    raster_path = temp.name+'/GHS_POP_GPW42015_GLOBE_R2015A_54009_1k_v1_0.tif'
+                    open(raster_path, 'wb').write(zipfile.read(zipfile.namelist()[3]))
+                    population_data = zonal_stats_batch(self.ds['geometry_54009'].values, raster_path, stats=['sum'])['sum'].values
+
+                    self.ds['population'] = (('nuts_2'),(np.array(population_data)))
+                    self.ds['population'].attrs['unit'] = 'People'
+                    self.ds = self.ds.drop('geometry_54009')
+                    temp.cleanup()
+
+                # add temperature data
+                re_ids = [pr.get_metadata(c,'renewables_nj_id') for c in self.countries]
+                weather = download_re_ninja_batch([(re_id,'weather') for re_id in re_ids], year)
+                temperature_data = [weather[(re_id,'weather')]['temperature'].to_list() for re_id in re_ids]
+                self.ds['temperature'] =  (('nuts_0','time'),(time_series_array(temperature_data)))
+                self.ds['temperature'].attrs['unit'] = 'Degrees Celsius'
 
     def add(self, component,  **kwargs):
-        comp_class = eval(component)
-        comp_class(self, **kwargs)
-
-    def save_dataset(self, dir_name):
-
-        if os.path.exists("data/saved_dataset/" + dir_name):
-            os.remove("data/saved_dataset/" +  dir_name)
-        geo_list = [str(geo) for geo in self.ds['geometry'].values]
-        self.ds['geometry'] = (('nuts_2'),(geo_list))
-        encoding = {k: {'zlib': True, 'shuffle': True} for k in self.ds.variables}
-        self.ds.to_netcdf("data/saved_dataset/" + dir_name, encoding=encoding)
-        self.ds['geometry'] = (('nuts_2'),pd.Series(self.ds['geometry']).apply(wkt.loads))
-
-    def create_regions(self, method, area_factor=None, initial_val=1, initial_seed=1):
+        with span(component, report=self.report, dataset=self) as s:
+            comp_class = eval(component)
+            if self.checkpoint_dir is None:
+                comp_class(self, **kwargs)
+                return
+
+            path = os.path.join(self.checkpoint_dir, '{}-{}.nc'.format(component, checkpoint_key(self, component, kwargs)))
+            s.tags['checkpoint'] = os.path.exists(path)
+            if os.path.exists(path):
+                os.utime(path)
+                merge_variables(self, xr.load_dataset(path), comp_class.writes)
+                return
+            comp_class(self, **kwargs)
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            self.ds[[var for var in comp_class.writes if var in self.ds.data_vars]].to_netcdf(path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+    def add_components(self, components, max_workers=None):
+        '''
+        components : List of component names or (name, kwargs) tuples
+        max_workers : number of threads, components run in parallel when they
+                      do not read or write the variables written by a previous component
+        '''
+        components = [(c, {}) if isinstance(c, str) else c for c in components]
+        comp_classes = [eval(name) for name, kwargs in components]
+
+        dependencies = []
+        for i, comp_class in enumerate(comp_classes):
+            used = set(comp_class.reads) | set(comp_class.writes)
+            dependencies.append([j for j in range(i) if used & set(comp_classes[j].writes)])
+
+        def run(i):
+            name, kwargs = components[i]
+            sandbox = copy.copy(self)
+            sandbox.ds = self.ds.copy()
+            sandbox.add(name, **kwargs)
+            return sandbox.ds
+
+        results = {}
+        merged = 0
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while merged < len(components):
+                for i in range(merged, len(components)):
+                    if i not in running and i not in results and all(j < merged for j in dependencies[i]):
+                        running[i] = executor.submit(run, i)
+                done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+                for i in [i for i, future in running.items() if future in done]:
+                    results[i] = running.pop(i).result()
+                # merge in the order of the list, the dataset does not depend on the completion order
+                while merged in results:
+                    merge_variables(self, results.pop(merged), comp_classes[merged].writes)
+                    print(components[merged][0] + ' addition complete')
+                    merged += 1
+
+    def save_dataset(self, dir_name, chunks=dataset_chunks, int16=False):
+        '''
+        dir_name : file name in data/saved_dataset, a name ending with .zarr is saved as a zarr store
+                   and the chunks are written in parallel, otherwise as a chunked netCDF
+        chunks : chunk sizes by dimension
+        int16 : if True, the hourly variables are saved as int16 with a scale factor and offset
+        '''
+        path = "data/saved_dataset/" + dir_name
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        ds = encode_geometry(self.ds)
+        if dir_name.endswith('.zarr'):
+            ds = ds.chunk({dim: min(size, ds.sizes[dim]) for dim, size in chunks.items() if dim in ds.dims})
+            for var in ds.variables.values():
+                var.encoding.pop('chunks', None)
+            encoding = {k: int16_encoding(ds[k]) for k in time_series_vars if int16 and k in ds.data_vars}
+            ds.to_zarr(path, mode='w', encoding=encoding)
+        else:
+            encoding = {}
+            for k, var in ds.variables.items():
+                encoding[k] = {'zlib': True, 'complevel': 1, 'shuffle': True}
+                if var.ndim > 0:
+                    encoding[k]['chunksizes'] = tuple(min(chunks.get(dim, size), size) for dim, size in zip(var.dims, var.shape))
+                if int16 and k in time_series_vars:
+                    encoding[k].update(int16_encoding(ds[k]))
+            ds.to_netcdf(path, encoding=encoding)
+
+    def create_regions(self, method, area_factor=None, initial_val=1, initial_seed=1, seeds=None, objective='p', max_workers=None):
+        '''
+        method : 'poli_regions', 'poli_regions_nuts1', 'rdm_regions' or 'max_p_regions'
+        seeds : list of seeds of rdm_regions and max_p_regions, the regions of the best run by objective
+                ('p' or 'heterogeneity') are kept, area_factor can then be a list.
+                The runs are solved on max_workers processes and kept in self.regions_search
+        With a checkpoint_dir, ds_regions and regions_assignment (region of each nuts_2 area) are saved, keyed by the
+        fingerprint of the dataset (see dataset_fingerprint) and the parameters, and loaded by the next calls with the same key
+        (regions_search is then not set)
+        '''
+        path = None
+        if self.checkpoint_dir is not None:
+            key = regions_key(self, method=method, area_factor=area_factor, initial_val=initial_val, initial_seed=initial_seed,
+                              seeds=None if seeds is None else list(seeds), objective=objective)
+            path = os.path.join(self.checkpoint_dir, 'regions-{}.nc'.format(key))
+            if os.path.exists(path):
+                os.utime(path)
+                ds = xr.load_dataset(path)
+                self.regions_assignment = ds['regions_assignment'].to_series()
+                self.ds_regions = decode_geometry(ds.drop_vars(['regions_assignment', 'nuts_2']))
+                return
 
         ds = self.ds.copy(deep=True)
 
@@ -116,25 +209,28 @@ class EUSES():
 
         island_groups = [['DK01','DK02','DK03'],['FI20','FI1B'],['ITG2','ITG1','ITF6'],['UKM3','UKN0'], ]
 
-        ds = aggregation(ds, island_groups)
-
         if 'BE34' and 'LU00' in ds.coords['nuts_2'].values:
-            ds = aggregation(ds, [['BE34','LU00']])
+            island_groups.append(['BE34','LU00'])
 
-        zones = gpd.GeoDataFrame(geometry=ds['geometry'].values)
-        zones['id'] = ds.coords['nuts_2'].values
+        # zones are the nuts_2 areas with merged islands, the dataset is aggregated once to the regions
+        zone_vars = ['geometry','rooftop_pv','utility_pv','pv_cf','onshore_wind','wind_cf',
+                     'offshore_wind','wind_offshore_cf','hydro_storage','population']
+        ds_zones = aggregation(ds[zone_vars], island_groups)
 
-        zones['pv_pot_e'] = (ds['rooftop_pv']+ds['utility_pv']).values * ds['pv_cf'].values.sum(axis=1)
-        zones['wind_on_pot_e'] = ds['onshore_wind'].values * ds['wind_cf'].values.sum(axis=1)
-        zones['wind_off_pot_e'] = ds['offshore_wind'].values * ds['wind_offshore_cf'].values.sum(axis=1)
+        zones = gpd.GeoDataFrame(geometry=ds_zones['geometry'].values)
+        zones['id'] = ds_zones.coords['nuts_2'].values
+
+        zones['pv_pot_e'] = (ds_zones['rooftop_pv']+ds_zones['utility_pv']).values * ds_zones['pv_cf'].values.sum(axis=1)
+        zones['wind_on_pot_e'] = ds_zones['onshore_wind'].values * ds_zones['wind_cf'].values.sum(axis=1)
+        zones['wind_off_pot_e'] = ds_zones['offshore_wind'].values * ds_zones['wind_offshore_cf'].values.sum(axis=1)
 
         zones['flh_max']=zones.loc[zones.pv_pot_e<zones.wind_on_pot_e].wind_on_pot_e
         zones.update(pd.Series(zones.loc[zones.pv_pot_e>zones.wind_on_pot_e].pv_pot_e, name='flh_max'))
         zones.update(pd.Series(zones.loc[zones.wind_off_pot_e>zones.flh_max].wind_off_pot_e, name='flh_max'))
         zones['flh_max'] = zones['flh_max'].fillna(0)
 
-        zones['storage'] = ds['hydro_storage'].sum(axis=1)
-        zones['population'] = ds['population']
+        zones['storage'] = ds_zones['hydro_storage'].sum(axis=1)
+        zones['population'] = ds_zones['population']
 
         zones['minimum_threshold'] = zones.geometry.area
 
@@ -142,10 +238,14 @@ class EUSES():
                         'poli_regions':2,'poli_regions_nuts1':3}
 
         if method in ['rdm_regions','max_p_regions']:
-            np.random.seed(initial_seed)
-            zones['rdm_values'] = np.random.rand(len(zones.index))
             feature = method_dir.get(method)
-            class_regions_int = max_p_regions(zones,feature,area_factor, initial_val)
+            if seeds is None:
+                np.random.seed(initial_seed)
+                zones['rdm_values'] = np.random.rand(len(zones.index))
+                class_regions_int = max_p_regions(zones,feature,area_factor, initial_val)
+            else:
+                area_factors = area_factor if isinstance(area_factor, (list, tuple)) else [area_factor]
+                class_regions_int, self.regions_search = max_p_search(zones, feature, area_factors, initial_val, seeds, objective, max_workers)
             if class_regions_int == False:
                 zones['nuts'] = zones['id'].str[:2]
                 nuts_array = zones['nuts'].unique()
@@ -157,7 +257,7 @@ class EUSES():
             class_regions_int = [np.where(zones['nuts']==x)[0].tolist() for x in nuts_array]
 
 
-        class_regions = [zones.loc[c].id.to_list() for c in class_regions_int]
+        class_regions = [[n for z in zones.loc[c].id for n in z.split(',')] for c in class_regions_int]
 
         ds = aggregation(ds,class_regions)
         ds.coords['regions'] = ('nuts_2', ds.coords['nuts_2'].values)
@@ -165,11 +265,18 @@ class EUSES():
         ds = ds.drop('nuts_2')
 
         self.ds_regions = ds
-
-    def create_calliope_model(self, op_mode='plan',sectors = ['power','heat'],co2_cap_factor=None, national=False):
-        '''
-        op_mode: either 'plan' or 'operate'
-        '''
+        self.regions_assignment = pd.Series({n: r for r in ds.coords['regions'].values for n in r.split(',')}, name='regions_assignment')
+        self.regions_assignment.index.name = 'nuts_2'
+
+        if path is not None:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            ds = encode_geometry(ds)
+            ds['regions_assignment'] = self.regions_assignment.to_xarray()
+            ds.to_netcdf(path + '.tmp')
+            os.replace(path + '.tmp', path)
+
+    def regions_geo(self, national=False):
+        ''' GeoDataFrame of the regions with the calliope location ids, in epsg:4326 '''
         ds_regions = self.ds_regions
 
         regions_geo = gpd.GeoDataFrame(columns=['geometry'], geometry=ds_regions['geometry'].values)
@@ -181,58 +288,218 @@ class EUSES():
 
         regions_geo.crs = {'init': 'epsg:3035'}
 
-        regions_geo = regions_geo.to_crs({'init': 'epsg:4326'})
+        return regions_geo.to_crs({'init': 'epsg:4326'})
+
+    def create_calliope_model(self, op_mode='plan',sectors = ['power','heat'],co2_cap_factor=None, national=False, n_days=None,
+                              model_dir='calliope_model'):
+        '''
+        op_mode: either 'plan' or 'operate'
+        n_days: number of representative days, None to model every day
+        model_dir: folder where the timeseries, locations and model files are written,
+                   a folder other than calliope_model is created with its technology and scenario files
+        '''
+        ds_regions = self.ds_regions
+        regions_geo = self.regions_geo(national)
+
+        prepare_model_dir(model_dir)
+        with span('create_timeseries_csv', report=self.report):
+            create_timeseries_csv(regions_geo, ds_regions, sectors, n_days, model_dir)
+        with span('create_location_yaml', report=self.report):
+            create_location_yaml(regions_geo, ds_regions,sectors, nuts2_region_index(regions_geo), model_dir)
+        with span('create_model_yaml', report=self.report):
+            create_model_yaml(self, regions_geo, sectors, op_mode, co2_cap_factor, n_days, model_dir)
+
+    def calliope_model(self, op_mode='plan',sectors = ['power','heat'],co2_cap_factor=None, national=False,
+                       n_days=None, scenario=None, override_dict=None):
+        '''
+        Return the calliope model of the regions without writing the model files,
+        the timeseries are passed as dataframes
+        op_mode: either 'plan' or 'operate'
+        n_days: number of representative days, None to model every day
+        scenario, override_dict: as in calliope.Model
+        '''
+        import calliope
+
+        regions_geo = self.regions_geo(national)
+        with span('create_model_dict', report=self.report):
+            model_dict = create_model_dict(self, regions_geo, sectors, op_mode, co2_cap_factor, nuts2_region_index(regions_geo), n_days)
+        with span('create_timeseries', report=self.report):
+            timeseries = create_timeseries(regions_geo, self.ds_regions, sectors, n_days)
+        missing = dataframe_references(model_dict) - set(timeseries)
+        if missing:
+            raise ValueError('timeseries {} are referenced by the model but not created'.format(sorted(missing)))
+        return calliope.Model(model_dict, scenario=scenario, override_dict=override_dict, timeseries_dataframes=timeseries)
+
+    def country_index(self, countries):
+        ''' Return the positions of the countries in the nuts_0 and nuts_2 coordinates '''
+        nuts_0s = [pr.get_metadata(c,'nuts_id') for c in countries]
+        country_codes = [pr.source_id(c,'nuts') for c in countries]
+        nuts_0_index = np.flatnonzero(np.isin(self.ds.coords['nuts_0'].values, nuts_0s))
+        nuts_2_index = np.flatnonzero(np.isin(self.ds['country_code'].values, country_codes))
+        return nuts_0_index, nuts_2_index
 
-        create_timeseries_csv(regions_geo, ds_regions, sectors)
-        create_location_yaml(regions_geo, ds_regions,sectors)
-        create_model_yaml(self, regions_geo, sectors, op_mode, co2_cap_factor)
+    def view(self, countries):
+        ''' Return a view of the countries without copy of the data, see EUSES_View '''
+        return EUSES_View(self, countries)
 
     def filter_countries(self, countries):
-        filt_ds = copy.deepcopy(self)
-        [filt_ds.countries.remove(c) for c in countries]
-        nuts_0s = [pr.get_metadata(c,'nuts_id') for c in countries]
-        if 'EE00' in nuts_0s:
-            nuts_0s.remove('EE00')
-            nuts_0s.append('EE')
-        if 'GR' in nuts_0s:
-            nuts_0s.remove('GR')
-            nuts_0s.append('EL')
-        nuts_0s_invers = [pr.get_metadata(c,'nuts_id') for c in filt_ds.countries]
-        nuts_2s = self.ds.where(self.ds['country_code'].isin(nuts_0s), drop = True).coords['nuts_2'].values
-        nuts_2s_invers = list(self.ds.coords['nuts_2'].values)
-        [nuts_2s_invers.remove(n2) for n2 in nuts_2s]
-        filt_ds.ds = filt_ds.ds.drop(nuts_0s_invers,dim='nuts_0')
-        filt_ds.ds = filt_ds.ds.drop(nuts_2s_invers,dim='nuts_2')
-        filt_ds.countries = countries
+        filt_ds = copy.copy(self)
+        nuts_0_index, nuts_2_index = self.country_index(countries)
+        filt_ds.ds = self.ds.isel(nuts_0=nuts_0_index, nuts_2=nuts_2_index).copy(deep=True)
+        filt_ds.countries = list(countries)
+
+        return filt_ds
 
+class EUSES_View():
+    '''
+    View of the countries of an EUSES dataset selected by index, the data is shared with the dataset.
+    The data of the view is read-only. Assigning a variable of the view only changes the view,
+    writable(var) gives a copy of var that can be changed in place and copy() a full copy.
+    '''
+
+    def __init__(self, parent, countries):
+        self.countries = list(countries)
+        self.year = parent.year
+        nuts_0_index, nuts_2_index = parent.country_index(countries)
+        ds = parent.ds.isel(nuts_0=as_slice(nuts_0_index), nuts_2=as_slice(nuts_2_index))
+        for name, var in ds.data_vars.items():
+            # only the arrays sliced from the parent are locked, the others are the arrays of the parent
+            sliced = ('nuts_0' in var.dims or 'nuts_2' in var.dims) and var.data is not parent.ds[name].data
+            if sliced and var.variable._in_memory and isinstance(var.data, np.ndarray):
+                var.data.flags.writeable = False
+        self.ds = ds
+
+    def __getitem__(self, var):
+        return self.ds[var]
+
+    def __setitem__(self, var, value):
+        self.ds[var] = value
+
+    def writable(self, var):
+        self.ds[var] = self.ds[var].copy(deep=True)
+        return self.ds[var]
+
+    def copy(self):
+        filt_ds = copy.copy(self)
+        filt_ds.ds = self.ds.copy(deep=True)
         return filt_ds
 
-def import_dataset(dir_name):
-    ds = xr.open_dataset("data/saved_dataset/" + dir_name)
+def as_slice(index):
+    ''' Contiguous positions as a slice, indexing with a slice does not copy numpy arrays '''
+    if len(index) > 0 and np.array_equal(index, np.arange(index[0], index[-1] + 1)):
+        return slice(index[0], index[-1] + 1)
+    return index
+
+def variable_hash(da):
+    ''' sha256 of the dimensions, coordinates and values of a DataArray '''
+    sha256 = hashlib.sha256()
+    for name in sorted(da.coords) + [None]:
+        values = da.values if name is None else da.coords[name].values
+        sha256.update(repr((name, da.dims, values.shape, str(values.dtype))).encode())
+        if values.dtype == object:
+            for value in values.ravel():
+                sha256.update(value.wkb if hasattr(value, 'wkb') else str(value).encode())
+        else:
+            sha256.update(np.ascontiguousarray(values).tobytes())
+    return sha256.hexdigest()
+
+def checkpoint_key(self, component, kwargs):
+    ''' Key of the result of a component: name, version, kwargs, precision and hashes of the variables it reads '''
+    comp_class = eval(component)
+    # the default values are part of the key, add(c) and add(c, **defaults) share a checkpoint
+    arguments = inspect.signature(comp_class).bind(None, **kwargs)
+    arguments.apply_defaults()
+    kwargs = dict(list(arguments.arguments.items())[1:])
+    inputs = {var: variable_hash(self.ds[var]) for var in comp_class.reads if var in self.ds.variables}
+    key = {'component': component, 'version': comp_class.version, 'kwargs': kwargs,
+           'countries': list(self.countries), 'year': self.year, 'inputs': inputs, 'precision': dict(precision),
+           'coords': {dim: variable_hash(self.ds.coords[dim]) for dim in ['nuts_0', 'nuts_2', 'time'] if dim in self.ds.coords}}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def dataset_fingerprint(self):
+    ''' sha256 of all the variables of the dataset, hashed on every call so that changes in place are included '''
+    hashes = {var: variable_hash(self.ds[var]) for var in self.ds.variables}
+    return hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()
+
+def regions_key(self, **params):
+    ''' Key of the regions of create_regions: parameters and fingerprint of the dataset '''
+    key = {'version': regions_version, 'params': params, 'dataset': dataset_fingerprint(self)}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+def evict_checkpoints(checkpoint_dir, max_size=None, max_age=None, prefix=''):
+    '''
+    Remove the checkpoints (components and regions) of checkpoint_dir whose name starts with prefix, e.g. 'regions-'.
+    max_age : checkpoints not used for max_age seconds are removed
+    max_size : least recently used checkpoints are removed until the folder fits in max_size bytes
+    Returns the paths removed
+    '''
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    paths = [os.path.join(checkpoint_dir, f) for f in os.listdir(checkpoint_dir) if f.startswith(prefix) and f.endswith('.nc')]
+    paths = sorted(paths, key=os.path.getmtime)
+    removed = []
+    if max_age is not None:
+        removed = [p for p in paths if os.path.getmtime(p) < time.time() - max_age]
+    if max_size is not None:
+        total = sum(os.path.getsize(p) for p in paths if p not in removed)
+        for p in paths:
+            if total <= max_size:
+                break
+            if p not in removed:
+                removed.append(p)
+                total -= os.path.getsize(p)
+    for p in removed:
+        os.remove(p)
+    return removed
+
+def merge_variables(self, ds, variables):
+    ''' Copy the variables of ds, with their coordinates, into the dataset of self '''
+    for var in variables:
+        if var not in ds.data_vars:
+            continue
+        for dim in ds[var].dims:
+            if dim in self.ds.dims and dim not in ['nuts_2', 'nuts_0', 'time']:
+                if not np.array_equal(self.ds.coords[dim].values, ds.coords[dim].values):
+                    self.ds = self.ds.drop_dims(dim)
+        self.ds[var] = ds[var]
+
+def import_dataset(dir_name, chunks=None, checkpoint_dir=None):
+    '''
+    dir_name : file name in data/saved_dataset (netCDF or .zarr store)
+    chunks : None loads the variables when used, 'auto', {} or a dict of chunk sizes by dimension
+             opens them lazily with dask, then only the chunks used are read
+    checkpoint_dir : folder of the component checkpoints, see EUSES
+    '''
+    path = "data/saved_dataset/" + dir_name
+    ds = xr.open_dataset(path, engine='zarr' if dir_name.endswith('.zarr') else None, chunks=chunks)
     countries = [pr.get_metadata(id,'name') for id in ds.coords['nuts_0'].values]
     year = pd.to_datetime(ds.coords['time'].values)[0].year
-    self = EUSES(countries,year,import_ds=True)
-    self.ds = ds
-    self.ds['geometry'] = (('nuts_2'),pd.Series(self.ds['geometry']).apply(wkt.loads))
+    self = EUSES(countries,year,import_ds=True,checkpoint_dir=checkpoint_dir)
+    self.ds = decode_geometry(ds)
     return self
 
-def build_dataset(countries, year=2010, save=True, dir_name = 'dataset.nc'):
+def build_dataset(countries, year=2010, save=True, dir_name = 'dataset.nc', max_workers=None, checkpoint_dir=None, trace=None):
+    '''
+    trace : JSON file where the wall time, downloads, RSS and dataset size change
+            of each component and country are saved, see EUSES.report
+    '''
     # Make list of all countries considered in NUTS 2 dataset
     if countries == 'EU':
         countries_metadata = pr.countries_metadata()
         countries = [country.get('name') for country in countries_metadata]
 
     # Build NUTS 2 dataset in EUSES dataset for the year
-    self = EUSES(countries, year)
+    self = EUSES(countries, year, checkpoint_dir=checkpoint_dir)
     # Add data components
     data_components_list = ['Power_Plants','Area','Hydro','Heat_Pumps',
                                 'VRE_Capacity_Factor','Power','Heat']
     print('Start building data variables')
-    for data_component in data_components_list:
-        self.add(data_component)
-        print(data_component + ' addition complete')
+    self.add_components(data_components_list, max_workers=max_workers)
     # export dataset
     if save==True:
-        self.save_dataset(dir_name)
+        with span('save_dataset', report=self.report, dataset=self):
+            self.save_dataset(dir_name)
+    if trace is not None:
+        self.report.to_json(trace)
 
     return self
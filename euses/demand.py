@@ -1,10 +1,6 @@
 import pandas as pd
 import geopandas as gpd
 import numpy as np
-from rasterstats import zonal_stats
-import bisect
-import requests
-import tempfile
 import io
 from io import BytesIO
 from shapely.geometry import MultiPolygon, Polygon, LinearRing, Point
@@ -12,61 +8,87 @@ from shapely import wkt
 import xarray as xr
 
 from . import parameters as pr
+from .utilib import fetch, fetch_path, entsoe_load
+from .spatial import assign_nuts2, zonal_stats_batch
+from .instrumentation import country_spans
+from .precision import time_series_zeros, precision
+
+def hot_water_load(calendar, generic_profile, keys):
+    ''' Return the load of the generic profile for each hour of the calendar.
+        calendar: DataFrame with the hour, dayofweek and season of every timestep
+        generic_profile: hotmaps generic profile of a single NUTS2 code
+        keys: calendar columns matched against the generic profile
+    '''
+    lookup = generic_profile.rename(columns={'day_type':'dayofweek'})[keys+['load']]
+    lookup = lookup.drop_duplicates(subset=keys).astype({k:'int64' for k in keys})
+    return calendar[keys].astype('int64').merge(lookup, how='left', on=keys)['load'].values
+
+def bisect_array(breakpoints, values):
+    ''' bisect.bisect of every value in values '''
+    if np.all(np.diff(breakpoints) >= 0):
+        return np.searchsorted(breakpoints, values, side='right')
+    # same binary search as bisect.bisect for unsorted breakpoints
+    lo = np.zeros(len(values), dtype='int64')
+    hi = np.full(len(values), len(breakpoints), dtype='int64')
+    while np.any(lo < hi):
+        search = lo < hi
+        mid = (lo + hi) // 2
+        right = values < np.asarray(breakpoints)[np.minimum(mid, len(breakpoints) - 1)]
+        hi = np.where(search & right, mid, hi)
+        lo = np.where(search & ~right, mid + 1, lo)
+    return lo
+
+def space_heating_load(temperature, hours, generic_profile):
+    ''' Return the load of the generic profile for the temperature of every timestep.
+        temperature, hours: temperature and hour of the day of every timestep
+        generic_profile: hotmaps generic profile with hours from 0 to 23
+    '''
+    load = np.full(len(temperature), np.nan)
+    for i in range(0,24):
+        gp_hour = generic_profile.loc[generic_profile.hour == i]
+        grades = gp_hour.load.values
+        breakpoints = gp_hour.temperature.values[:-1]
+        index = hours == i
+        load[index] = grades[bisect_array(breakpoints, temperature[index])]
+    return load
 
 class Power():
+    reads = ['population', 'country_code']
+    writes = ['power']
+    version = 1
+
     def __init__(self,EUSES, **kwargs):
         ds = EUSES.ds
         year = EUSES.year
         time_range = ds.coords['time']
 
-        load_excel = pd.read_excel('https://eepublicdownloads.blob.core.windows.net/public-cdn-container/clean-documents/Publications/Statistics/Monthly-hourly-load-values_2006-2015.xlsx', header=3)
-
-        ds['power'] = (('nuts_2','time'),(np.array([[t*0.0 for t in range(len(time_range))]]*len(ds.coords['nuts_2']))))
+        ds['power'] = (('nuts_2','time'),(time_series_zeros(ds, ('nuts_2','time'))))
         ds['power'].attrs['unit'] = 'MW'
 
-        def entsoe_hourly(id,year):
-            if id == 'UK':
-                id = 'GB'
-            n_rows = int(len(time_range) / 24)
-            load_ger_range = load_excel.query('Year == {} & Country == "{}"'.format(year,id))
-            load_sep = load_ger_range.drop(['Country','Year','Month','Day','Coverage ratio'], axis=1)[0:n_rows]
-
-            load_profile = pd.DataFrame()
-            for i, row in load_sep.iterrows():
-                load_profile = pd.concat([load_profile,row])
-            load_profile.columns = ['load_in_MW']
-            load_profile.index = time_range.values
-            return load_profile.fillna(load_profile.load_in_MW.mean())
-
-
-        for c in EUSES.countries:
-            id = pr.get_metadata(c,'renewables_nj_id')
-            ds_c = EUSES.filter_countries([c]).ds
-
-            # ds_c = ds.where(ds['country_code'] == id, drop = True)
-            load_profile = entsoe_hourly(id,year)
+        for c in country_spans(EUSES.countries):
+            ds_c = EUSES.view([c]).ds
 
-            population_sum = ds_c['population'].sum().item()
+            load_profile = np.trunc(entsoe_load(pr.source_id(c,'entsoe','renewables_nj_id'), year, len(time_range)))
 
-            for nuts_2_id in ds_c.coords['nuts_2']:
-                power_profile = [round(ds_c['population'].loc[nuts_2_id].values.item()/population_sum * int(x),3) for x in load_profile.load_in_MW]
-                ds['power'].loc[nuts_2_id] = power_profile
+            # share of the national load of every nuts_2 area, by population
+            population = ds_c['population'].values
+            power_profile = np.round(np.outer(population / population.sum(), load_profile), 3)
+            ds['power'].loc[ds_c.coords['nuts_2'].values] = power_profile
 
 class Heat():
+    reads = ['geometry', 'country_code', 'temperature']
+    writes = ['heat', 'heat_centralized', 'heat_decentralized']
+    version = 1
 
     def __init__(self,EUSES, decentralized=False, **kwargs):
-        temp = tempfile.TemporaryDirectory()
-
         ds = EUSES.ds
         year = EUSES.year
         time_range = ds.coords['time']
 
-        r = requests.get('https://gitlab.com/hotmaps/heat/heat_tot_curr_density/-/raw/master/data/heat_tot_curr_density.tif')
-        hd_path = temp.name+'/heat_tot_curr_density.tif'
-        open(hd_path, 'wb').write(r.content)
+        hd_path = fetch_path('https://gitlab.com/hotmaps/heat/heat_tot_curr_density/-/raw/master/data/heat_tot_curr_density.tif')
 
-        r = requests.get('https://gitlab.com/hotmaps/space_heating_cooling_dhw_demand/-/raw/master/data/space_heating_cooling_dhw_top-down.csv')
-        hotmaps_volumes = pd.read_csv(io.StringIO(r.content.decode('utf-8')), sep=r"|")
+        r = fetch('https://gitlab.com/hotmaps/space_heating_cooling_dhw_demand/-/raw/master/data/space_heating_cooling_dhw_top-down.csv')
+        hotmaps_volumes = pd.read_csv(io.BytesIO(r), sep=r"|")
 
         def heating_volumes():
             sectors = ['residential','service']
@@ -77,89 +99,57 @@ class Heat():
                     ds[sector+'_'+eu] = (('nuts_2',),(np.array([0.0]*len(ds.coords['nuts_2']))))
 
 
-            for c in EUSES.countries:
-                id = pr.get_metadata(c,'nuts_id')
-                hotmaps_id = pr.get_metadata(c,'nuts_id')
-                similar_countries = {'HR':["AL", "MK", "ME"], 'LU':["CH"], 'SE': ["NO"], 'EE': ['EE00']}
-                if pr.get_metadata(c,'hotmaps_id') == None:
-                    hotmaps_id = pr.get_metadata(c,'nuts_id')
-                for replacement, country in similar_countries.items():
-                    if hotmaps_id in country:
-                        hotmaps_id = replacement
+            heat_ued = zonal_stats_batch(ds['geometry'].values, hd_path, stats=['sum'])['sum'] # MWh/year
+            heat_ued.index = ds.coords['nuts_2'].values
+
+            for c in country_spans(EUSES.countries):
+                hotmaps_id = pr.source_id(c,'hotmaps')
 
                 sh_dhw = hotmaps_volumes.loc[hotmaps_volumes.country_code == hotmaps_id.lower()]
 
                 total_heat_ued = sh_dhw.query('topic == "Total useful heating demand - residential and service sector [TWh/y]"').value.iloc[0]
 
-                ds_c = EUSES.filter_countries([c]).ds
+                nuts_2_c = EUSES.view([c]).ds.coords['nuts_2'].values
 
                 for sector, end_use in dict(zip(sectors,[end_uses,end_uses])).items():
                     sh_share = sh_dhw.query('feature == "Total useful heating demand,  per country - '+ sector +' sector [TWh/y]"').value.iloc[0]/total_heat_ued
                     hw_share = sh_dhw.query('feature == "Total useful DHW demand,  per country - '+ sector +' sector [TWh/y]"').value.iloc[0]/total_heat_ued
-                    ds_c[sector+'_space_heating'].loc[:] = sh_share
-                    ds_c[sector+'_hot_water'].loc[:] = hw_share
-
-                for sector, end_use in dict(zip(sectors,[end_uses,end_uses])).items():
-                    for eu in end_use:
-                        for nuts_2_id in ds_c.coords['nuts_2']:
-                            heat_ued = zonal_stats(ds['geometry'].loc[nuts_2_id].values.item(), hd_path, stats='sum')[0].get('sum') # MWh/year
-                            ds[sector+'_'+eu].loc[nuts_2_id] = ds_c[sector+'_'+eu].loc[nuts_2_id] * heat_ued
+                    ds[sector+'_space_heating'].loc[nuts_2_c] = sh_share * heat_ued.loc[nuts_2_c].values
+                    ds[sector+'_hot_water'].loc[nuts_2_c] = hw_share * heat_ued.loc[nuts_2_c].values
 
         def space_heating():
-            r = requests.get('https://gitlab.com/hotmaps/load_profile/load_profile_tertiary_heating_generic/-/raw/master/data/hotmaps_task_2.7_load_profile_tertiary_heating_generic.csv')
-            hotmaps_profile_tert_heat = pd.read_csv(io.StringIO(r.content.decode('utf-8')))
+            r = fetch('https://gitlab.com/hotmaps/load_profile/load_profile_tertiary_heating_generic/-/raw/master/data/hotmaps_task_2.7_load_profile_tertiary_heating_generic.csv')
+            hotmaps_profile_tert_heat = pd.read_csv(io.BytesIO(r))
 
-            r = requests.get('https://gitlab.com/hotmaps/load_profile/load_profile_residential_heating_generic/-/raw/master/data/hotmaps_task_2.7_load_profile_residential_heating_generic.csv')
-            hotmaps_profile_resid_heat = pd.read_csv(io.StringIO(r.content.decode('utf-8')))
+            r = fetch('https://gitlab.com/hotmaps/load_profile/load_profile_residential_heating_generic/-/raw/master/data/hotmaps_task_2.7_load_profile_residential_heating_generic.csv')
+            hotmaps_profile_resid_heat = pd.read_csv(io.BytesIO(r))
 
             space_heating_dic = {
                                  "residential" : hotmaps_profile_resid_heat,
                                  "service" : hotmaps_profile_tert_heat,
                                 }
 
+            country_code = ds['country_code'].values
             for sector,generic_profile in space_heating_dic.items():
-                residential_space_heating = []
-                service_space_heating = []
-
-                for nuts2_id in ds.coords['nuts_2'].values:
-                    nuts0_id = ds.sel(nuts_2=nuts2_id)['country_code'].values.item()
+                generic_profile.hour = generic_profile.hour.replace(24,0)
+                heat_volume = ds[sector+'_space_heating'].values
+                space_heating_profile = time_series_zeros(ds, ('nuts_2','time'))
+                country_load = {}
 
-                    hotmaps_id = nuts0_id
-                    similar_countries = {'SE':["NO"], 'LU':["CH"]}
-                    for replacement, country in similar_countries.items():
-                        if nuts0_id in country:
-                            hotmaps_id = replacement
+                for code in np.unique(country_code):
+                    nuts_2_index = country_code == code
+                    nuts0_id = pr.nuts_id_from_code(code)
+                    hotmaps_id = pr.source_id(nuts0_id,'hotmaps_profiles')
 
-                    similar_countries = {'HR':["AL", "MK", "ME"], 'EE00': ['EE'], 'GR':["EL"]}
-                    for replacement, country in similar_countries.items():
-                        if nuts0_id in country:
-                            nuts0_id = replacement
+                    if (nuts0_id, hotmaps_id) not in country_load:
+                        temperature = ds['temperature'].loc[nuts0_id]
+                        gp_nuts_id = generic_profile.loc[generic_profile['NUTS2_code'].str.contains(hotmaps_id)]
+                        load = space_heating_load(temperature.values, temperature['time'].dt.hour.values, gp_nuts_id)
+                        country_load[(nuts0_id, hotmaps_id)] = load/np.nansum(load)
 
-                    temperature_to_load = ds['temperature'].loc[nuts0_id].to_dataframe()
-                    temperature_to_load['hour'] = temperature_to_load.index.hour
+                    space_heating_profile[nuts_2_index] = np.round(np.outer(heat_volume[nuts_2_index], country_load[(nuts0_id, hotmaps_id)]), 4)
 
-                    generic_profile.hour = generic_profile.hour.replace(24,0)
-                    gp_nuts_id = generic_profile.loc[generic_profile['NUTS2_code'].str.contains(hotmaps_id)]
-                    for i in range(0,24):
-
-                        grades = gp_nuts_id.query('hour == {}'.format(i)).load
-                        breakpoints = gp_nuts_id.query('hour == {}'.format(i)).temperature
-                        breakpoints = breakpoints.drop(index=breakpoints[-1:].index)
-
-                        score_series = temperature_to_load.query('hour=={}'.format(i))['temperature']
-
-                        def grade(score, breakpoints=breakpoints.tolist() , grades=grades.tolist()):
-                             i = bisect.bisect(breakpoints, score)
-                             return grades[i]
-
-                        index_filter = temperature_to_load.query('hour == {}'.format(i)).index
-                        temperature_to_load.loc[index_filter,'load'] = pd.Series(index=index_filter.tolist(),data=[grade(score) for score in score_series.tolist()])
-                    heat_volume = ds[sector+'_space_heating'].loc[nuts2_id].values.item()
-
-                    profile = (temperature_to_load.load/temperature_to_load.load.sum()*heat_volume).round(4)
-                    eval(sector+'_space_heating').append(profile.to_list())
-
-                ds[sector+'_space_heating_profile'] = (('nuts_2','time'),(np.array(eval(sector+'_space_heating'))))
+                ds[sector+'_space_heating_profile'] = (('nuts_2','time'),(space_heating_profile))
                 ds[sector+'_space_heating_profile'].attrs['unit'] = 'MW'
 
         def hot_water():
@@ -187,11 +177,11 @@ class Heat():
                     'end_date': '/08/31'
                 },
             ]
-            r = requests.get('https://gitlab.com/hotmaps/load_profile/load_profile_residential_shw_generic/-/raw/master/data/hotmaps_task_2.7_load_profile_residential_shw_generic.csv')
-            hotmaps_profile_resid_shw = pd.read_csv(io.StringIO(r.content.decode('utf-8')))
+            r = fetch('https://gitlab.com/hotmaps/load_profile/load_profile_residential_shw_generic/-/raw/master/data/hotmaps_task_2.7_load_profile_residential_shw_generic.csv')
+            hotmaps_profile_resid_shw = pd.read_csv(io.BytesIO(r))
 
-            r = requests.get('https://gitlab.com/hotmaps/load_profile/load_profile_tertiary_shw_generic/-/raw/master/data/hotmaps_task_2.7_load_profile_tertiary_shw_generic.csv')
-            hotmaps_profile_ter_shw = pd.read_csv(io.StringIO(r.content.decode('utf-8')))
+            r = fetch('https://gitlab.com/hotmaps/load_profile/load_profile_tertiary_shw_generic/-/raw/master/data/hotmaps_task_2.7_load_profile_tertiary_shw_generic.csv')
+            hotmaps_profile_ter_shw = pd.read_csv(io.BytesIO(r))
 
             hot_water_dic = {
                                  "residential" : hotmaps_profile_resid_shw,
@@ -211,46 +201,33 @@ class Heat():
             s = pd.date_range(str(year), str(year+1), freq='H')[:-1]
             season_df['dayofweek'] = s.to_series().dt.dayofweek.replace([0, 1, 2, 3, 4], 0).replace({5: 1, 6: 2})
             season_df['hour'] = s.to_series().dt.hour.replace(0, 24)
+            calendar = season_df.reindex(time_range.values)
 
 
             sectors = ['residential','service']
             for sector in sectors:
-                ds[sector+'_hot_water_profile'] = (('nuts_2','time'),(np.array([[t*0.0 for t in range(len(time_range))]]*len(ds.nuts_2))))
-
-            for c in EUSES.countries:
-                name = pr.get_metadata(c,'name')
+                ds[sector+'_hot_water_profile'] = (('nuts_2','time'),(time_series_zeros(ds, ('nuts_2','time'))))
 
-                nuts_0_id = pr.get_metadata(c,'nuts_id')
-                hotmaps_id = pr.get_metadata(c,'nuts_id')
-                similar_countries = {'HR':["AL", "MK", "ME"], 'LU':["CH"], 'SE': ["NO"], 'EL':['GR']}
-                if pr.get_metadata(c,'hotmaps_id') == None:
-                    hotmaps_id = pr.get_metadata(c,'nuts_id')
-                for replacement, country in similar_countries.items():
-                    if hotmaps_id in country:
-                        hotmaps_id = replacement
+            for c in country_spans(EUSES.countries):
+                hotmaps_id = pr.source_id(c,'hotmaps_profiles')
 
                 for sector,generic_profile in hot_water_dic.items():
                     if True not in generic_profile.NUTS2_code.str.contains(hotmaps_id).tolist():
                         generic_profile = hotmaps_profile_resid_shw
                     gp_c = generic_profile.loc[generic_profile['NUTS2_code'].str.contains(hotmaps_id)]
                     gp_c_nuts_id = gp_c.NUTS2_code.unique()[0]
-                    gp_nuts_id = generic_profile.loc[generic_profile['NUTS2_code'].str.contains(gp_c_nuts_id)]
-
-                    country_profile = pd.DataFrame(index = time_range.values, columns=['load'])
-                    for i, rows in season_df.iterrows():
-                        if sector == 'residential':
-                            query_string = 'NUTS2_code=="{}" & hour == {} & day_type == {} & season == {}'
-                            country_profile.loc[i,'load'] = gp_nuts_id.query(query_string.format(gp_c_nuts_id,rows.hour, rows.dayofweek, rows.season)).iloc[0].load
-                        else:
-                            query_string = 'NUTS2_code=="{}" & hour == {} & day_type == {}'
-                            country_profile.loc[i,'load'] = gp_nuts_id.query(query_string.format(gp_c_nuts_id,rows.hour, rows.dayofweek)).iloc[0].load
 
-                    profile_pu = country_profile.load/country_profile.load.sum()
+                    if sector == 'residential':
+                        keys = ['hour','dayofweek','season']
+                    else:
+                        keys = ['hour','dayofweek']
+                    load = hot_water_load(calendar, generic_profile.loc[generic_profile['NUTS2_code'] == gp_c_nuts_id], keys)
+                    profile_pu = load/load.sum()
 
-                    nuts_2_array =  ds['country_code'].where(ds['country_code']==nuts_0_id[:2])['nuts_2'].values
-                    for nuts2_id in nuts_2_array:
-                        heat_volume = ds[sector+'_hot_water'].loc[nuts2_id].values.item()
-                        ds[sector+'_hot_water_profile'].loc[nuts2_id] = profile_pu*heat_volume
+                    nuts_2_code = pr.source_id(c,'nuts')
+                    nuts_2_array = ds.coords['nuts_2'].values[ds['country_code'].values == nuts_2_code]
+                    heat_volume = ds[sector+'_hot_water'].loc[nuts_2_array].values
+                    ds[sector+'_hot_water_profile'].loc[nuts_2_array] = np.outer(heat_volume, profile_pu)
 
         heating_volumes()
         hot_water()
@@ -273,10 +250,9 @@ class Heat():
             ds['heat_sum'] = ds['heat'].copy()
             ds['heat_centralized'] = ds['heat'].copy()
             ds['heat_decentralized'] = ds['heat'].copy()
-            for c in EUSES.countries:
+            for c in country_spans(EUSES.countries):
                 dh_share = pr.get_metadata(c,'dh_share')
-                nuts_0_id = pr.get_metadata(c,'nuts_id')
-                nuts_2_array =  ds['country_code'].where(ds['country_code']==nuts_0_id[:2])['nuts_2'].values
+                nuts_2_array =  ds['country_code'].where(ds['country_code']==pr.source_id(c,'nuts'))['nuts_2'].values
                 for nuts2_id in nuts_2_array:
                     ds['heat_centralized'].loc[nuts2_id] = ds['heat_sum'].loc[nuts2_id] * dh_share
                     ds['heat_decentralized'].loc[nuts2_id] = ds['heat_sum'].loc[nuts2_id] * (1-dh_share)
@@ -284,18 +260,24 @@ class Heat():
             ds = ds.drop('heat_sum')
         EUSES.ds = ds
 
-        temp.cleanup()
-
 class Iron_and_Steel():
+    reads = ['geometry', 'country_code']
+    writes = ['industries', 'industries_demand']
+    version = 2
 
-    def __init__(self,EUSES, h2_per_t = 60, h2_kWh_per_kg = 33.33, power_eaf = 0.65, power_add = 0.32, dic_correction = {'DE':45e6}, **kwargs):
+    def __init__(self,EUSES, h2_per_t = 60, h2_kWh_per_kg = 33.33, power_eaf = 0.65, power_add = 0.32, dic_correction = {'DE':45e6}, profile = 'flat', **kwargs):
+        '''
+        industries_demand holds the annual demand of each nuts_2 area, the hourly demand is built on export
+        with industries_demand_series. profile: 'flat' or the name of a (time) variable of the dataset
+        with the hourly profile of the demand
+        '''
 
         ds = EUSES.ds
 
         hotmaps_industry_directory = 'https://gitlab.com/hotmaps/industrial_sites/industrial_sites_Industrial_Database/-/raw/master/data/Industrial_Database.csv'
-        r = requests.get(hotmaps_industry_directory)
+        r = fetch(hotmaps_industry_directory)
 
-        industries = pd.read_csv(io.StringIO(r.content.decode('utf-8')),sep=';')
+        industries = pd.read_csv(io.BytesIO(r),sep=';')
         df = industries.loc[industries.Subsector == 'Iron and steel']
         df = df.loc[df.geom.str.contains('4326').dropna().index]
         df['geometry'] = [geom[1] for geom in df.geom.str.split(';')]
@@ -306,20 +288,17 @@ class Iron_and_Steel():
         isp_gpd['sector'] =  isp_gpd['Subsector']
         isp_gpd.loc[isp_gpd['CompanyName'].dropna().loc[isp_gpd['CompanyName'].str.contains('Saarstahl AG').dropna()].index]
 
-        df = pd.DataFrame()
-        for nuts_2_geo in ds['geometry']:
-            nuts_2_id = nuts_2_geo.coords['nuts_2'].values.item()
-            df1 = pd.DataFrame(isp_gpd.loc[isp_gpd.within(nuts_2_geo.item())].groupby(['sector']).sum().Production.rename(nuts_2_id)).T
-            df = df.append(df1)
+        isp_gpd['nuts_2'] = assign_nuts2(isp_gpd, ds)
+        df = isp_gpd.groupby(['nuts_2','sector']).Production.sum().unstack().reindex(ds.coords['nuts_2'].values)
 
         sector = np.unique(df.T.index.get_level_values('sector').values)
         e_form = ['hydrogen','power']
         array = np.array([df.T[n2].to_xarray().values for n2 in df.index])
 
-        array_power = array * [[[1]*8760]] * (power_eaf+power_add) / 8760
-        array_h2 = array *  [[[1]*8760]] * h2_per_t * h2_kWh_per_kg * 1e-3 / 8760
+        array_power = array.T * (power_eaf+power_add)
+        array_h2 = array.T * h2_per_t * h2_kWh_per_kg * 1e-3
         xda_capacity =  xr.DataArray(array, coords=[df.index, sector ], dims=["nuts_2","sector"])
-        xda_demand  = xr.DataArray([np.concatenate((array_h2,array_power))], coords=[sector,e_form,df.index, ds.coords["time"].values], dims=["sector","e_form","nuts_2","time"])
+        xda_demand  = xr.DataArray(np.stack((array_h2,array_power), axis=1), coords=[sector,e_form,df.index], dims=["sector","e_form","nuts_2"])
         for i in ['industries','sector']:
             if i in ds.data_vars or i in ds.coords:
                 ds = ds.drop(i)
@@ -330,10 +309,27 @@ class Iron_and_Steel():
 
         ds.coords['e_form'] = ['hydrogen','power']
         ds['industries_demand'] = xda_demand
-        ds['industries_demand'].attrs['unit'] = 'MWh'
+        ds['industries_demand'].attrs['unit'] = 'MWh/year'
+        ds['industries_demand'].attrs['profile'] = profile
 
         for nuts_0, cumulative_capacity in dic_correction.items():
             nuts_2_c = ds['country_code'].loc[ds['country_code'].str.contains(nuts_0)].coords['nuts_2'].values
             correction_factor = cumulative_capacity / ds['industries'].loc[nuts_2_c].sum()
             ds['industries'].loc[nuts_2_c] = ds['industries'].loc[nuts_2_c] * correction_factor
             ds['industries_demand'].loc[{'nuts_2':nuts_2_c}] = ds['industries_demand'].loc[{'nuts_2':nuts_2_c}] * correction_factor
+
+def industries_demand_series(ds, e_form, sector='Iron and steel'):
+    ''' Hourly demand of the sector in the energy form e_form (MW), from the annual demand
+        in industries_demand and its profile. Datasets with an hourly industries_demand are returned as is.
+    '''
+    demand = ds['industries_demand'].loc[{'sector':sector, 'e_form':e_form}]
+    if 'time' in demand.dims:
+        return demand
+    profile = demand.attrs.get('profile', 'flat')
+    if profile in ds.data_vars:
+        shares = ds[profile] / ds[profile].sum('time')
+    else:
+        year = pd.DatetimeIndex(ds.coords['time'].values)[0].year
+        hours = (pd.Timestamp(str(year+1)) - pd.Timestamp(str(year))) / pd.Timedelta('1h')
+        shares = xr.full_like(ds.coords['time'], 1/hours, dtype='float64')
+    return (demand * shares).astype(precision['time_series'])
@@ -0,0 +1,175 @@
+import os
+import time
+import json
+import threading
+import contextvars
+from contextlib import contextmanager
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    # only used where /proc is not available, otherwise the RSS is not recorded
+    psutil = None
+
+_current_span = contextvars.ContextVar('euses_span', default=None)
+_span_lock = threading.Lock()
+# stages being recorded, their peak RSS is sampled every rss_interval seconds by a background thread
+_open_spans = set()
+_sampler = {'thread': None}
+rss_interval = 0.02
+
+def current_rss():
+    ''' Resident set size of the process in bytes, None if it cannot be read '''
+    if os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+def _sample_rss():
+    while True:
+        time.sleep(rss_interval)
+        rss = current_rss()
+        with _span_lock:
+            if not _open_spans:
+                _sampler['thread'] = None
+                return
+            for s in _open_spans:
+                s.peak_rss = max(s.peak_rss, rss)
+
+def _open(s):
+    s.rss_start = s.peak_rss = current_rss()
+    if s.rss_start is None:
+        return
+    with _span_lock:
+        _open_spans.add(s)
+        if _sampler['thread'] is None:
+            _sampler['thread'] = threading.Thread(target=_sample_rss, daemon=True)
+            _sampler['thread'].start()
+
+def _close(s):
+    s.rss_end = current_rss()
+    if s.rss_end is None:
+        return
+    with _span_lock:
+        _open_spans.discard(s)
+        s.peak_rss = max(s.peak_rss, s.rss_end)
+
+class Span():
+    '''
+    Measurements of one stage of a build: wall time, bytes downloaded (with the downloads of nested stages),
+    RSS of the process at the start and end of the stage, its peak during the stage and change of the dataset size.
+    With stages running in parallel the RSS includes the memory of the other stages.
+    '''
+
+    def __init__(self, name, parent=None, **tags):
+        self.name = name
+        self.parent = parent
+        self.tags = tags
+        self.children = []
+        self.start = time.time()
+        self.wall_time = None
+        self.bytes_downloaded = 0
+        self.rss_start = None
+        self.rss_end = None
+        self.peak_rss = None
+        self.ds_nbytes_delta = None
+
+    def path(self):
+        if self.parent is None:
+            return self.name
+        return self.parent.path() + '/' + self.name
+
+    def to_dict(self):
+        return {'name': self.name, 'tags': self.tags, 'start': self.start, 'wall_time': self.wall_time,
+                'bytes_downloaded': self.bytes_downloaded, 'rss_start': self.rss_start, 'rss_end': self.rss_end, 'peak_rss': self.peak_rss,
+                'ds_nbytes_delta': self.ds_nbytes_delta, 'children': [c.to_dict() for c in self.children]}
+
+class Report():
+    ''' Spans recorded for an EUSES dataset, see EUSES.report '''
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def iter_spans(self):
+        stack = list(reversed(self.spans))
+        while stack:
+            span = stack.pop()
+            yield span
+            stack.extend(reversed(span.children))
+
+    def to_dataframe(self):
+        ''' One row by span, the nested spans are named by their path '''
+        rows = [dict(path=s.path(), wall_time=s.wall_time, bytes_downloaded=s.bytes_downloaded,
+                     rss_start=s.rss_start, rss_end=s.rss_end, peak_rss=s.peak_rss,
+                     ds_nbytes_delta=s.ds_nbytes_delta, **s.tags) for s in self.iter_spans()]
+        return pd.DataFrame(rows).set_index('path') if rows else pd.DataFrame()
+
+    def to_json(self, path):
+        ''' Save the spans as a JSON trace '''
+        with open(path, 'w') as f:
+            json.dump([s.to_dict() for s in self.spans], f, indent=1, default=str)
+
+    def __repr__(self):
+        return self.to_dataframe().to_string()
+
+@contextmanager
+def span(name, report=None, dataset=None, **tags):
+    '''
+    Record a stage of the build, nested in the current stage of the thread.
+    report: Report where a stage without parent is added, if None and no current stage it is not recorded
+    dataset: EUSES dataset of which the change of size is recorded
+    tags: e.g. country
+    '''
+    parent = _current_span.get()
+    if parent is None and report is None:
+        yield None
+        return
+    s = Span(name, parent, **tags)
+    nbytes = dataset.ds.nbytes if dataset is not None else None
+    token = _current_span.set(s)
+    _open(s)
+    start = time.perf_counter()
+    try:
+        yield s
+    finally:
+        s.wall_time = time.perf_counter() - start
+        _close(s)
+        if dataset is not None:
+            s.ds_nbytes_delta = dataset.ds.nbytes - nbytes
+        _current_span.reset(token)
+        if parent is None:
+            report.add(s)
+        else:
+            with _span_lock:
+                parent.children.append(s)
+
+def count_download(nbytes):
+    ''' Add downloaded bytes to the current stage and the stages it is nested in '''
+    s = _current_span.get()
+    with _span_lock:
+        while s is not None:
+            s.bytes_downloaded += nbytes
+            s = s.parent
+
+def country_spans(countries, **tags):
+    ''' Iterate over the countries, each iteration is recorded as a stage nested in the current stage '''
+    for c in countries:
+        with span(c, country=c, **tags):
+            yield c
@@ -1,61 +1,106 @@
 import geopandas as gpd
 import pandas as pd
 import sys
+import re
 import ruamel.yaml
-from geopy import distance
+import numpy as np
 yaml = ruamel.yaml.YAML()
 from . import parameters as pr
+from .spatial import adjacent_pairs, geodesic_distance
+from .timeseries import cluster_days
+from .demand import industries_demand_series
 import os
+import shutil
+from functools import lru_cache
 
 vre_dic = {'Wind':['onshore_wind',5],'Solar':['rooftop_pv',170],'Wind Offshore':['offshore_wind',5.36]}
 
-dc_links = pd.read_csv('data/links/dc_links.csv')
+data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
 
-def export_timeseries(regions_geo, ds_regions,data_name,sign):
+@lru_cache(maxsize=None)
+def _read_dc_links():
+    return pd.read_csv(os.path.join(data_dir, 'links', 'dc_links.csv'))
+
+def dc_links():
+    ''' DC links between nuts_2 areas, read once from data/links/dc_links.csv '''
+    return _read_dc_links().copy()
+
+def nuts2_region_index(regions_geo):
+    ''' Return the region id of each nuts_2 area of the regions '''
+    return {nuts_2: id for id, nuts_2s in zip(regions_geo.id, regions_geo.nuts_2s) for nuts_2 in str(nuts_2s).split(',')}
+
+def prepare_model_dir(model_dir, template_dir='calliope_model'):
+    ''' Create model_dir with the technology and scenario files of template_dir '''
+    os.makedirs(os.path.join(model_dir, 'model_config'), exist_ok=True)
+    os.makedirs(os.path.join(model_dir, 'timeseries_data'), exist_ok=True)
+    if os.path.abspath(model_dir) == os.path.abspath(template_dir):
+        return
+    for path in ['scenarios.yaml'] + [os.path.join('model_config', f) for f in os.listdir(os.path.join(template_dir, 'model_config'))
+                                      if f.startswith('techs')]:
+        shutil.copyfile(os.path.join(template_dir, path), os.path.join(model_dir, path))
+
+def timeseries_dataframe(regions_geo, ds_regions, data_name, sign):
     df = pd.DataFrame(index= ds_regions.time.values)
     for i,rows in regions_geo.iterrows():
         if len(ds_regions[data_name].loc[rows.nuts_2s].values) != 0:
             df[rows.id] = ds_regions[data_name].loc[rows.nuts_2s].values
-    df = df * sign
-    df.to_csv('calliope_model/timeseries_data/{}.csv'.format(data_name))
+    return df * sign
 
-def create_timeseries_csv(regions_geo, ds_regions, sectors):
+def create_timeseries(regions_geo, ds_regions, sectors, n_days=None):
+    ''' Return the timeseries of the model as a dictionary of DataFrames by name,
+        with n_days the cluster of each day of the year is added as clusters
+    '''
     data_list = [{'power':-1}, {'heat':-1}, {'pv_cf':1}, {'wind_cf':1},
                     {'wind_offshore_cf':1}, {'hydro_inflow':1},
                     {'cop_air':1}]
     if 'iron and steel' in sectors:
         data_list.append({'hydrogen':-1})
-        ds_regions['power'] = ds_regions['power'] + ds_regions['industries_demand'].loc[{'e_form':'power','sector':'Iron and steel'}]
-        ds_regions['hydrogen'] = ds_regions['industries_demand'].loc[{'e_form':'hydrogen','sector':'Iron and steel'}]
+        ds_regions = ds_regions.assign(power=ds_regions['power'] + industries_demand_series(ds_regions, 'power'),
+                                       hydrogen=industries_demand_series(ds_regions, 'hydrogen'))
+    timeseries = {}
     for series in data_list:
         v, k = series.popitem()
-        export_timeseries(regions_geo, ds_regions,v,k)
+        timeseries[v] = timeseries_dataframe(regions_geo, ds_regions,v,k)
+    if n_days is not None:
+        timeseries['clusters'] = cluster_days(ds_regions, n_days).to_frame()
+    return timeseries
 
-def create_location_yaml(regions_geo, ds_regions, sectors):
-    ds_regions["power_plants"] = ds_regions["power_plants"].groupby('tech').sum('fuel')
-    yaml = ruamel.yaml.YAML()
+def create_timeseries_csv(regions_geo, ds_regions, sectors, n_days=None, model_dir='calliope_model'):
+    for data_name, df in create_timeseries(regions_geo, ds_regions, sectors, n_days).items():
+        df.to_csv(os.path.join(model_dir, 'timeseries_data', '{}.csv'.format(data_name)))
+
+def timeseries_reference(data_name, source):
+    ''' source: 'file' for the csv files in timeseries_data, 'df' for timeseries dataframes '''
+    if source == 'df':
+        return 'df={}'.format(data_name)
+    return 'file={}.csv'.format(data_name)
+
+def create_locations(regions_geo, ds_regions, sectors, nuts2_region=None, source='file'):
+    ''' Return the locations and links of the model as a dictionary,
+        source: 'file' or 'df', how the timeseries are referenced
+    '''
+    ds_regions = ds_regions.assign(power_plants=ds_regions["power_plants"].groupby('tech').sum('fuel'))
 
     if len(regions_geo) > 1 :
         dict_file = {'locations': {},'links': {}}
     else:
         dict_file = {'locations': {}}
 
-    line_lenght = [0]
     for i, rows in regions_geo.iterrows():
         dict_file['locations'][rows.id]= {}
         coords = rows.geometry.centroid
         dict_file['locations'][rows.id]['coordinates'] = {'lat':round(coords.y,2),'lon':round(coords.x,2)}
         dict_file['locations'][rows.id]['techs'] = {}
-        dict_file['locations'][rows.id]['techs']['demand_electricity'] = {'constraints':{'resource':'file=power.csv'}}
+        dict_file['locations'][rows.id]['techs']['demand_electricity'] = {'constraints':{'resource':timeseries_reference('power', source)}}
 
 
         if 'heat' in sectors:
-            dict_file['locations'][rows.id]['techs']['demand_heat'] = {'constraints':{'resource':'file=heat.csv'}}
+            dict_file['locations'][rows.id]['techs']['demand_heat'] = {'constraints':{'resource':timeseries_reference('heat', source)}}
             for add_tech in ['supply_gas','supply_biogas', 'heat_pump_air']:
                 dict_file['locations'][rows.id]['techs'][add_tech] = None
 
         if 'iron and steel' in sectors:
-            dict_file['locations'][rows.id]['techs']['demand_hydrogen'] = {'constraints':{'resource':'file=hydrogen.csv'}}
+            dict_file['locations'][rows.id]['techs']['demand_hydrogen'] = {'constraints':{'resource':timeseries_reference('hydrogen', source)}}
             for add_tech in ['electrolyser','fuel_cell', 'h2_storage']:
                 dict_file['locations'][rows.id]['techs'][add_tech] = None
 
@@ -91,32 +136,36 @@ def create_location_yaml(regions_geo, ds_regions, sectors):
         for techs in storages:
             dict_file['locations'][rows.id]['techs'][techs] = None
 
-        for j, rows_2 in regions_geo.iterrows():
-            g1_geo = rows.geometry.buffer(0.0001)
-            g2_geo = rows_2.geometry.buffer(0.0001)
-            fr = rows.geometry.centroid
-            to = rows_2.geometry.centroid
-            length = int(distance.distance((fr.y,fr.x), (to.y,to.x)).km*1.25)
-            if g1_geo.intersects(g2_geo) == True and length not in line_lenght:
-                line_lenght.append(length)
-                trans_dic = {'techs':{'ac_transmission': {'distance':length/1e2} }}
-                dict_file['links']['{},{}'.format(rows.id, rows_2.id)] = trans_dic
-
-    for i,rows in dc_links.iterrows():
-        rows_filtr_from = regions_geo[regions_geo.nuts_2s.astype(str).str.contains(rows['from'],regex=True)]
-        rows_filtr_to = regions_geo[regions_geo.nuts_2s.astype(str).str.contains(rows['to'],regex=True)]
-        if (rows_filtr_to.empty or rows_filtr_from.empty) == False:
-            fr_index = rows_filtr_from.id.values[0]
-            to_index = rows_filtr_to.id.values[0]
-            if rows_filtr_from.iloc[0].id != rows_filtr_to.iloc[0].id:
-                trans_dic = {'techs':{'dc_transmission': {'constraints':{'energy_cap_equals':rows.capacity},'distance':rows.length/1e2} }}
-                dict_file['links']['{},{}'.format(fr_index, to_index)] = trans_dic
-
-
-    with open(r'calliope_model/model_config/locations.yaml', 'w') as file:
+    # ac links between neighbouring regions, with the centroid distance increased by 25 %
+    pairs = adjacent_pairs(regions_geo.geometry.values)
+    if len(pairs) > 0:
+        centroids = regions_geo.geometry.centroid.values
+        fr_index, to_index = [np.array(index) for index in zip(*pairs)]
+        lengths = (geodesic_distance(centroids[fr_index], centroids[to_index])*1.25).astype(int)
+        for fr, to, length in zip(fr_index, to_index, lengths):
+            trans_dic = {'techs':{'ac_transmission': {'distance':int(length)/1e2} }}
+            dict_file['links']['{},{}'.format(regions_geo.id.iloc[fr], regions_geo.id.iloc[to])] = trans_dic
+
+    if nuts2_region is None:
+        nuts2_region = nuts2_region_index(regions_geo)
+    for i,rows in dc_links().iterrows():
+        fr_index = nuts2_region.get(rows['from'])
+        to_index = nuts2_region.get(rows['to'])
+        if fr_index is not None and to_index is not None and fr_index != to_index:
+            trans_dic = {'techs':{'dc_transmission': {'constraints':{'energy_cap_equals':rows.capacity},'distance':rows.length/1e2} }}
+            dict_file['links']['{},{}'.format(fr_index, to_index)] = trans_dic
+
+    return dict_file
+
+def create_location_yaml(regions_geo, ds_regions, sectors, nuts2_region=None, model_dir='calliope_model'):
+    dict_file = create_locations(regions_geo, ds_regions, sectors, nuts2_region)
+    with open(os.path.join(model_dir, 'model_config', 'locations.yaml'), 'w') as file:
         documents = yaml.dump(dict_file, file)
 
-def create_model_yaml(self, regions_geo, sectors, op_mode, co2_cap_factor):
+def create_model_config(self, regions_geo, sectors, op_mode, co2_cap_factor, n_days=None, source='file'):
+    ''' Return the model configuration as a dictionary, the model_config files are imported.
+        n_days: number of representative days, the days are clustered with the clusters timeseries
+    '''
     ds_regions = self.ds_regions
     pop_factor = ds_regions["population"].sum()/500.9e6
     year = self.year
@@ -130,6 +179,11 @@ def create_model_yaml(self, regions_geo, sectors, op_mode, co2_cap_factor):
     dict_file['model']['timeseries_data_path'] = 'timeseries_data'
     dict_file['model']['subset_time'] = ['{}-01-01'.format(year), '{}-12-31'.format(year)]
     # dict_file['model']['time'] = {'function':'resample','function_options':{'resolution': '3H'}}
+    if n_days is not None:
+        clustering_func = timeseries_reference('clusters', source) + ':cluster'
+        dict_file['model']['time'] = {'function':'apply_clustering',
+                                      'function_options':{'clustering_func': clustering_func, 'how': 'closest',
+                                                          'storage_inter_cluster': op_mode == 'plan'}}
 
     dict_file['run']['solver'] = 'cbc'
     dict_file['run']['ensure_feasibility'] = 'false'
@@ -171,5 +225,40 @@ def create_model_yaml(self, regions_geo, sectors, op_mode, co2_cap_factor):
     if 'iron and steel' in sectors:
         dict_file['import'] = ['model_config/techs_elec_heat_h2.yaml','model_config/locations.yaml', 'scenarios.yaml']
 
-    with open(r'calliope_model/model.yaml', 'w') as file:
+    return dict_file
+
+def create_model_yaml(self, regions_geo, sectors, op_mode, co2_cap_factor, n_days=None, model_dir='calliope_model'):
+    dict_file = create_model_config(self, regions_geo, sectors, op_mode, co2_cap_factor, n_days)
+    with open(os.path.join(model_dir, 'model.yaml'), 'w') as file:
         documents = yaml.dump(dict_file, file)
+
+def dataframe_references(config, names=None):
+    ''' Replace the file=<name>.csv timeseries references of the nested dictionary config by df=<name>,
+        returns the set of timeseries names referenced
+    '''
+    names = set() if names is None else names
+    for k, v in config.items():
+        if isinstance(v, dict):
+            dataframe_references(v, names)
+        elif isinstance(v, str) and v.startswith(('file=', 'df=')):
+            name = re.match(r'(?:file|df)=([^:]+?)(?:\.csv)?(:.*)?$', v)
+            config[k] = 'df=' + name.group(1) + (name.group(2) or '')
+            names.add(name.group(1))
+    return names
+
+def create_model_dict(self, regions_geo, sectors, op_mode, co2_cap_factor, nuts2_region=None, n_days=None, model_dir='calliope_model'):
+    ''' Return the model configuration with the locations in memory and every timeseries referenced
+        as a dataframe (df=<name>), the yaml imports other than the locations are read from model_dir
+    '''
+    import calliope
+
+    config = create_model_config(self, regions_geo, sectors, op_mode, co2_cap_factor, n_days, source='df')
+    del config['model']['timeseries_data_path']
+    model_dict = calliope.AttrDict()
+    for path in config.pop('import'):
+        if path != 'model_config/locations.yaml':
+            model_dict.union(calliope.AttrDict.from_yaml(os.path.join(model_dir, path)), allow_override=True)
+    model_dict.union(calliope.AttrDict(create_locations(regions_geo, self.ds_regions, sectors, nuts2_region, source='df')), allow_override=True)
+    model_dict.union(calliope.AttrDict(config), allow_override=True)
+    dataframe_references(model_dict)
+    return model_dict
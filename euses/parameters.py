@@ -276,15 +276,38 @@ countries =[
     # ]
 
 
+# codes of the countries in the data sources, by nuts_id, when they differ from the metadata of the country.
+# Countries missing from a source use the data of a similar country.
+source_aliases = {
+    'nuts': {'GR':'EL', 'EE00':'EE'},                                   # country_code of the NUTS 2013 regions
+    'hotmaps': {'AL':'HR', 'MK':'HR', 'ME':'HR', 'CH':'LU', 'NO':'SE', 'EE00':'EE'}, # heating volumes
+    'hotmaps_profiles': {'AL':'HR', 'MK':'HR', 'ME':'HR', 'CH':'LU', 'NO':'SE', 'GR':'EL'}, # generic load profiles
+    'hydro_inflow': {'GR':'EL', 'LU':'CH', 'UK':'UK'},                  # by renewables_nj_id otherwise
+    'entsoe': {'UK':'GB'},                                              # by renewables_nj_id otherwise
+    'wind_farms': {'UK':'United Kingdom'},                              # by name otherwise
+}
+
+_countries_by = {key: {c[key]: c for c in countries} for key in ['name', 'nuts_id', 'renewables_nj_id']}
+_nuts_id_by_code = {source_aliases['nuts'].get(c['nuts_id'], c['nuts_id']): c['nuts_id'] for c in countries}
+
 def countries_metadata():
     return countries
 
+def get_country(country_id, key='name'):
+    ''' Metadata of the country by name, nuts_id or renewables_nj_id, None if not found '''
+    return _countries_by[key].get(country_id)
 
 def get_metadata(country_name, metadata):
-    for c in countries:
-        if c.get('name') == country_name:
-            metadata = c.get(metadata)
-        if c.get('nuts_id') == country_name:
-            metadata = c.get(metadata)
-            # print(metadata)
-    return metadata
+    ''' metadata of the country by name or nuts_id, the metadata argument is returned if the country is not found '''
+    c = _countries_by['nuts_id'].get(country_name, _countries_by['name'].get(country_name))
+    if c is None:
+        return metadata
+    return c.get(metadata)
+
+def source_id(country_name, source, metadata='nuts_id'):
+    ''' Code of the country (name or nuts_id) in a data source of source_aliases, by default the metadata of the country '''
+    return source_aliases[source].get(get_metadata(country_name, 'nuts_id'), get_metadata(country_name, metadata))
+
+def nuts_id_from_code(country_code):
+    ''' nuts_id of the country of a NUTS country_code '''
+    return _nuts_id_by_code.get(country_code, country_code)
@@ -0,0 +1,30 @@
+import numpy as np
+
+# dtype of the hourly variables of the dataset, capacity factors, profiles and temperature
+precision = {'time_series': 'float32'}
+
+time_series_vars = ['power', 'heat', 'heat_centralized', 'heat_decentralized', 'wind_cf', 'pv_cf', 'wind_offshore_cf',
+                    'cop_air', 'hydro_inflow', 'temperature']
+
+def set_precision(time_series=None):
+    ''' time_series: dtype of the hourly variables, e.g. 'float32' or 'float64' '''
+    if time_series is not None:
+        precision['time_series'] = np.dtype(time_series).name
+    return precision
+
+def time_series_zeros(ds, dims):
+    ''' Array of zeros with the sizes of the dims of ds, in the precision of the hourly variables '''
+    return np.zeros([ds.sizes[d] for d in dims], dtype=precision['time_series'])
+
+def time_series_array(values):
+    return np.asarray(values, dtype=precision['time_series'])
+
+def int16_encoding(da):
+    ''' netCDF/zarr encoding of da as int16 with a scale factor and offset covering its range,
+        the largest error is half of (max - min) / 65534
+    '''
+    v_min, v_max = float(da.min()), float(da.max())
+    if not np.isfinite(v_min) or not np.isfinite(v_max):
+        v_min, v_max = 0.0, 0.0
+    scale_factor = (v_max - v_min) / 65534 if v_max > v_min else 1.0
+    return {'dtype': 'int16', 'scale_factor': scale_factor, 'add_offset': (v_max + v_min) / 2, '_FillValue': np.int16(-32768)}
@@ -2,29 +2,31 @@ import pandas as pd
 import numpy as np
 from statistics import mean
 import geopandas as gpd
-from io import BytesIO
 from zipfile import ZipFile
-from urllib.request import urlopen
 import tempfile
-from rasterstats import zonal_stats
-import requests
 
 from . import parameters as pr
-from .utilib import download_re_ninja
+from .utilib import download_re_ninja_batch, fetch_path
+from .spatial import assign_nuts2, zonal_stats_batch
+from .instrumentation import country_spans
+from .precision import time_series_zeros
 from shapely.geometry import MultiPolygon, Polygon, LinearRing, Point
 
 
 class Hydro():
+    reads = ['geometry', 'country_code']
+    writes = ['hydro_capacity', 'hydro_storage', 'hydro_inflow']
+    version = 1
+
     def __init__(self, EUSES):
 
         ds = EUSES.ds
         year = EUSES.year
         time_range = EUSES.ds.time.values
 
-        r = urlopen("https://zenodo.org/record/804244/files/Hydro_Inflow.zip")
-        zipfile = ZipFile(BytesIO(r.read()))
+        zipfile = ZipFile(fetch_path("https://zenodo.org/record/804244/files/Hydro_Inflow.zip"))
 
-        df_jrc = pd.read_csv('https://raw.githubusercontent.com/energy-modelling-toolkit/hydro-power-database/v7/data/jrc-hydro-power-plant-database.csv')
+        df_jrc = pd.read_csv(fetch_path('https://raw.githubusercontent.com/energy-modelling-toolkit/hydro-power-database/v7/data/jrc-hydro-power-plant-database.csv'))
 
 
         tech_list = [tech for tech in df_jrc.type.unique()]
@@ -32,46 +34,30 @@ class Hydro():
         tech_list.remove('HROR')
         ds.coords['hydro_storage_tech'] = tech_list
 
-        data_mw = []
-        data_mwh = []
-
-        for tech in df_jrc.type.unique():
-            df = df_jrc.query('type == "{}"'.format(tech))
-            geometry = [Point(xy) for xy in zip(df.lon, df.lat)]
-            df = df.drop(['lat', 'lon'], axis=1)
-            df = gpd.GeoDataFrame(df, geometry=geometry)
-            df.crs = {'init': 'epsg:4326'}
-            df = df.to_crs({'init': 'epsg:3035'})
-            df = df.fillna(0)
-
-            filter = df['storage_capacity_MWh'] == 0
-            df.loc[filter]['storage_capacity_MWh'] = df.loc[filter]['installed_capacity_MW'] * 6
-
-            data = []
-            for nuts2 in ds['geometry']:
-                data.append(df.loc[df.within(nuts2.values.item())].sum()['installed_capacity_MW'])
-            data_mw.append(data)
-
-
-            if tech != 'HROR':
-                data = []
-                for nuts2 in ds['geometry']:
-                    data.append(df.loc[df.within(nuts2.values.item())].sum()['storage_capacity_MWh'])
-                data_mwh.append(data)
-
-        ds['hydro_capacity'] = (('nuts_2','hydro_tech'),(np.array(data_mw).T))
-        ds['hydro_storage'] = (('nuts_2','hydro_storage_tech'),(np.array(data_mwh).T))
-
-        ds['hydro_inflow'] = (('nuts_2','time'),(np.array([[t*0.0 for t in range(len(time_range))]]*len(ds.coords['nuts_2']))))
-        for c in EUSES.countries:
-            ds_c = EUSES.filter_countries([c]).ds
-            id = pr.get_metadata(c,'renewables_nj_id')
-            replacement_dic = {'GR':'EL','LU':'CH','GB':'UK'}
+        geometry = [Point(xy) for xy in zip(df_jrc.lon, df_jrc.lat)]
+        df = df_jrc.drop(['lat', 'lon'], axis=1)
+        df = gpd.GeoDataFrame(df, geometry=geometry)
+        df.crs = {'init': 'epsg:4326'}
+        df = df.to_crs({'init': 'epsg:3035'})
+        df = df.fillna(0)
+
+        filter = df['storage_capacity_MWh'] == 0
+        df.loc[filter]['storage_capacity_MWh'] = df.loc[filter]['installed_capacity_MW'] * 6
+
+        df['nuts_2'] = assign_nuts2(df, ds)
+        hydro_sum = df.groupby(['type','nuts_2'])[['installed_capacity_MW','storage_capacity_MWh']].sum()
+        data_mw = hydro_sum['installed_capacity_MW'].unstack().reindex(index=ds.coords['hydro_tech'].values, columns=ds.coords['nuts_2'].values).fillna(0)
+        data_mwh = hydro_sum['storage_capacity_MWh'].unstack().reindex(index=tech_list, columns=ds.coords['nuts_2'].values).fillna(0)
+
+        ds['hydro_capacity'] = (('nuts_2','hydro_tech'),(data_mw.values.T))
+        ds['hydro_storage'] = (('nuts_2','hydro_storage_tech'),(data_mwh.values.T))
+
+        ds['hydro_inflow'] = (('nuts_2','time'),(time_series_zeros(ds, ('nuts_2','time'))))
+        for c in country_spans(EUSES.countries):
+            ds_c = EUSES.view([c]).ds
             sum_hydro = ds_c['hydro_capacity'].sum().values.item()
             if sum_hydro > 0:
-                hd_id = id
-                if id in replacement_dic.keys():
-                    hd_id = replacement_dic.get(id)
+                hd_id = pr.source_id(c,'hydro_inflow','renewables_nj_id')
                 df_inflow = pd.read_csv(zipfile.open('Hydro_Inflow_{}.csv'.format(hd_id))).query('Year == '+ str(year))
 
                 days = pd.date_range(str(year),str(year+1), freq='D')[:-1]
@@ -86,16 +72,20 @@ class Hydro():
                     ds['hydro_inflow'].loc[nuts_2_id] = df_inflow_norm_h
 
 class Heat_Pumps():
+    reads = ['temperature', 'country_code']
+    writes = ['cop_air']
+    version = 1
+
     def __init__(self, EUSES, cop_max_air=3.2, temp_room = 21):
         year =  EUSES.year
         ds = EUSES.ds
         time_range = ds.coords['time']
 
         cop_air = []
-        ds['cop_air'] = (('nuts_2','time'),(np.array([[t*0.0 for t in range(len(time_range))]]*len(ds.coords['nuts_2']))))
+        ds['cop_air'] = (('nuts_2','time'),(time_series_zeros(ds, ('nuts_2','time'))))
 
-        for c in EUSES.countries:
-            ds_c = EUSES.filter_countries([c]).ds
+        for c in country_spans(EUSES.countries):
+            ds_c = EUSES.view([c]).ds
             temperature_to_load = pd.DataFrame(
                 index=time_range.values,
                 columns=['temp_air', 'cop_air'])
@@ -114,6 +104,10 @@ class Heat_Pumps():
                 ds['cop_air'].loc[nuts_2_id] = (temperature_to_load.cop_air*cop_max_air).to_list()
 
 class VRE_Capacity_Factor():
+    reads = ['country_code']
+    writes = ['wind_cf', 'pv_cf', 'wind_offshore_cf']
+    version = 1
+
     def __init__(self, EUSES, technologies = ['wind','pv','wind_offshore']):
         ds = EUSES.ds
         time_range = ds.coords['time']
@@ -121,20 +115,27 @@ class VRE_Capacity_Factor():
 
 
         if 'wind_offshore' in technologies:
-            ds['wind_offshore_cf'] = (('nuts_0','time'),(np.array([[t*0.0 for t in range(len(time_range))]]*len(ds.coords['nuts_0']))))
+            ds['wind_offshore_cf'] = (('nuts_0','time'),(time_series_zeros(ds, ('nuts_0','time'))))
         if 'wind' in technologies:
-            ds['wind_cf'] = (('nuts_2','time'),(np.array([[t*0.0 for t in range(len(time_range))]]*len(ds.coords['nuts_2']))))
+            ds['wind_cf'] = (('nuts_2','time'),(time_series_zeros(ds, ('nuts_2','time'))))
         if 'pv' in technologies:
-            ds['pv_cf'] = (('nuts_2','time'),(np.array([[t*0.0 for t in range(len(time_range))]]*len(ds.coords['nuts_2']))))
+            ds['pv_cf'] = (('nuts_2','time'),(time_series_zeros(ds, ('nuts_2','time'))))
 
+        pairs = []
         for tech in technologies:
             for c in EUSES.countries:
-                print(tech,c)
+                re_id = pr.get_metadata(c,'renewables_nj_id')
+                if tech != 'wind_offshore' or re_id in ['NL','DE','FI','DK','SE','NO','GB','IE','BE','FR','GR','EE']:
+                    pairs.append((re_id, tech))
+        re_ninja_data = download_re_ninja_batch(pairs, year)
+
+        for tech in technologies:
+            for c in country_spans(EUSES.countries, tech=tech):
                 re_id = pr.get_metadata(c,'renewables_nj_id')
                 nuts0_id = pr.get_metadata(c,'nuts_id')
-                ds_c = EUSES.filter_countries([c]).ds
+                ds_c = EUSES.view([c]).ds
                 if tech != 'wind_offshore':
-                    data = download_re_ninja(year, re_id, tech)
+                    data = re_ninja_data[(re_id, tech)]
                     data = data.filter(items=[c for c in data.columns if c[3:] != 'TOTAL'])
                     for nuts2_id in ds_c.coords['nuts_2'].values:
                         if re_id in ['MK','LU','LV','LT'] and tech =='wind':
@@ -144,10 +145,14 @@ class VRE_Capacity_Factor():
 
                 else:
                     if re_id in ['NL','DE','FI','DK','SE','NO','GB','IE','BE','FR','GR','EE']:
-                        data = download_re_ninja(year, re_id, tech).filter(items=['national'])
+                        data = re_ninja_data[(re_id, tech)].filter(items=['national'])
                         ds['wind_offshore_cf'].loc[nuts0_id] = data['national']
 
 class Area():
+    reads = ['geometry', 'country_code']
+    writes = ['rooftop_pv', 'utility_pv', 'onshore_wind', 'offshore_wind']
+    version = 1
+
     def __init__(self, EUSES):
         year =  EUSES.year
         ds = EUSES.ds
@@ -160,9 +165,9 @@ class Area():
         building_af_no = pd.Series(building_no)*0.49
 
 
-        solar_jrc = pd.read_excel('https://cidportal.jrc.ec.europa.eu/ftp/jrc-opendata/ENSPRESO/ENSPRESO_SOLAR_PV_CSP.XLSX',sheet_name='Raw Data Available Areas',index_col=1,header=2)
+        solar_jrc = pd.read_excel(fetch_path('https://cidportal.jrc.ec.europa.eu/ftp/jrc-opendata/ENSPRESO/ENSPRESO_SOLAR_PV_CSP.XLSX'),sheet_name='Raw Data Available Areas',index_col=1,header=2)
 
-        wind_jrc = pd.read_excel('https://cidportal.jrc.ec.europa.eu/ftp/jrc-opendata/ENSPRESO/ENSPRESO_WIND_ONSHORE_OFFSHORE.XLSX',sheet_name='Raw data',index_col=1,header=5)
+        wind_jrc = pd.read_excel(fetch_path('https://cidportal.jrc.ec.europa.eu/ftp/jrc-opendata/ENSPRESO/ENSPRESO_WIND_ONSHORE_OFFSHORE.XLSX'),sheet_name='Raw data',index_col=1,header=5)
 
         rooftop_pv = solar_jrc[["SURARTRESROO","SURARTINDROO","SURARTRESFAC","SURARTINDFAC"]].sum(axis=1)
         utility_pv = solar_jrc[["SURNATAGRHIG", "SURNATAGRLOW",
@@ -190,32 +195,30 @@ class Area():
                         ds[c].loc[nuts_2_id] = eval(c).loc[nuts_2_id.values]
 
             if c == 'onshore_wind':
-                for nuts_2_id, nuts_0_id in ds['country_code'].to_dataframe().iterrows():
+                country_code = ds['country_code'].to_series()
+                nuts_2_ch = country_code.loc[country_code == 'CH'].index.values
+                if len(nuts_2_ch) > 0:
                     temp = tempfile.TemporaryDirectory()
-                    if nuts_0_id['country_code'] == 'CH':
-                        temp = tempfile.TemporaryDirectory()
-                        resp = urlopen("https://data.geo.admin.ch/ch.bfe.windenergie-potenzialgebiete/data.zip")
-                        zipfile = ZipFile(BytesIO(resp.read()))
-                        path = temp.name + '/rastermap_v200605_einfarbig.tif'
-                        open(path, 'wb').write(zipfile.read(zipfile.namelist()[5]))
-                        area = zonal_stats(ds['geometry'].loc[nuts_2_id].values.item(), path, stats='count')[0].get('count')
-                        ds[c].loc[nuts_2_id] = area*6250/1e6
-                    if nuts_0_id['country_code'] == 'NO':
-                        r = requests.get('https://gitlab.com/hotmaps/potential/potential_wind/-/raw/master/data/wind_100m.tif?inline=false')
-                        path = temp.name+'/wind_100m.tif'
-                        open(path, 'wb').write(r.content)
-                        area = zonal_stats(ds['geometry'].loc[nuts_2_id].values.item(), path, stats='count')[0].get('count')
-                        ds[c].loc[nuts_2_id] = area*900/1e6
+                    zipfile = ZipFile(fetch_path("https://data.geo.admin.ch/ch.bfe.windenergie-potenzialgebiete/data.zip"))
+                    path = temp.name + '/rastermap_v200605_einfarbig.tif'
+                    open(path, 'wb').write(zipfile.read(zipfile.namelist()[5]))
+                    area = zonal_stats_batch(ds['geometry'].loc[nuts_2_ch].values, path, stats=['count'])['count'].values
+                    ds[c].loc[nuts_2_ch] = area*6250/1e6
                     temp.cleanup()
+                nuts_2_no = country_code.loc[country_code == 'NO'].index.values
+                if len(nuts_2_no) > 0:
+                    path = fetch_path('https://gitlab.com/hotmaps/potential/potential_wind/-/raw/master/data/wind_100m.tif?inline=false')
+                    area = zonal_stats_batch(ds['geometry'].loc[nuts_2_no].values, path, stats=['count'])['count'].values
+                    ds[c].loc[nuts_2_no] = area*900/1e6
 
             if c == 'offshore_wind':
-                for country in EUSES.countries:
+                for country in country_spans(EUSES.countries):
                     offshore_mrgid = pr.get_metadata(country,'MRGID')
                     nuts_0 = pr.get_metadata(country,'nuts_id')
                     if type(offshore_mrgid) == int:
                         if country != 'Norway':
                             iso_id = pr.get_metadata(c,'iso_3')
-                            eez_c =  gpd.read_file('https://geo.vliz.be/geoserver/MarineRegions/wfs?service=WFS&version=1.0.0&request=GetFeature&typeNames=eez&cql_filter=mrgid={}&outputFormat=application/json'.format(str(offshore_mrgid)))
+                            eez_c =  gpd.read_file(fetch_path('https://geo.vliz.be/geoserver/MarineRegions/wfs?service=WFS&version=1.0.0&request=GetFeature&typeNames=eez&cql_filter=mrgid={}&outputFormat=application/json'.format(str(offshore_mrgid))))
                             eez_geo = eez_c.iloc[0].geometry
                             nuts_gdp = gpd.GeoDataFrame(ds.where(ds['country_code'].isin(nuts_0), drop = True)['geometry'].to_dataframe())
                             eez_c_geo = eez_c.to_crs({'init': 'epsg:3035'}).iloc[0].geometry
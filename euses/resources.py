@@ -4,22 +4,32 @@ import numpy as np
 from statistics import mean
 from shapely.geometry import MultiPolygon, Polygon, LinearRing, Point
 import geopandas as gpd
+import json
+from urllib.parse import urljoin
 from datapackage import Package
-from io import BytesIO
-from zipfile import ZipFile
 from rasterstats import zonal_stats
 
 from . import parameters as pr
+from .utilib import fetch, fetch_path
+from .spatial import assign_nuts2
+from .instrumentation import country_spans
 
 
 class Power_Plants():
+    reads = ['geometry', 'country_code']
+    writes = ['power_plants']
+    version = 1
+
     def __init__(self, EUSES):
 
         ds = EUSES.ds
         year = EUSES.year
         time_range = EUSES.ds.time.values
 
-        package = Package('https://data.open-power-system-data.org/conventional_power_plants/2020-10-01/datapackage.json')
+        package_url = 'https://data.open-power-system-data.org/conventional_power_plants/2020-10-01/datapackage.json'
+        descriptor = json.loads(fetch(package_url))
+        descriptor['resources'][3]['path'] = fetch_path(urljoin(package_url, descriptor['resources'][3]['path']))
+        package = Package(descriptor, unsafe=True)
         df = pd.DataFrame(package.resources[3].data)
         geometry = [Point(xy) for xy in zip(df.lon, df.lat)]
         df = df.drop(['lon', 'lat'], axis=1)
@@ -30,17 +40,13 @@ class Power_Plants():
         gppd['fuel'] = gppd['energy_source'].fillna('Unspecified')
 
 
-        df = pd.DataFrame()
-        for nuts_2_geo in ds['geometry']:
-            nuts_2_id = nuts_2_geo.coords['nuts_2'].values.item()
-            df1 = pd.DataFrame(gppd.loc[gppd.within(nuts_2_geo.item())].groupby(['tech','fuel']).sum().capacity.rename(nuts_2_id)).T
-            df = df.append(df1)
+        gppd['nuts_2'] = assign_nuts2(gppd, ds)
+        capacity = gppd.groupby(['nuts_2','tech','fuel']).capacity.sum()
 
-        tech = np.unique(df.T.index.get_level_values('tech').values)
-        fuel = np.unique(df.T.index.get_level_values('fuel').values)
+        tech = np.unique(capacity.index.get_level_values('tech').values)
+        fuel = np.unique(capacity.index.get_level_values('fuel').values)
 
-        array = np.array([df.T[n2].to_xarray().values for n2 in df.index])
-        xda =  xr.DataArray(array, coords=[df.index, tech ,fuel ], dims=["nuts_2","tech","fuel"])
+        xda = capacity.to_xarray().reindex(nuts_2=ds.coords['nuts_2'].values, tech=tech, fuel=fuel)
 
         for i in ['power_plants','tech','fuel']:
             if i in ds.data_vars or i in ds.coords:
@@ -53,7 +59,7 @@ class Power_Plants():
 
         # Add solar and onshore wind capacities from opsd data
 
-        df = pd.read_csv('https://data.open-power-system-data.org/renewable_power_plants/2020-08-25/renewable_power_plants_EU.csv')
+        df = pd.read_csv(fetch_path('https://data.open-power-system-data.org/renewable_power_plants/2020-08-25/renewable_power_plants_EU.csv'))
 
         geometry = [Point(xy) for xy in zip(df.lon, df.lat)]
         crs = {'init': 'epsg:4326'}
@@ -61,17 +67,14 @@ class Power_Plants():
         opsd_re = opsd_re.to_crs({'init': 'epsg:3035'})
 
         df_1 = ds['power_plants'].to_dataframe().T
-        for id in opsd_re.country.unique():
-            if id in ds.coords['nuts_0'].values:
-                dsc = ds.where(ds['country_code'] == id, drop=True)
-                opsd_re_c = opsd_re.loc[opsd_re.country ==id ]
-                for nuts_2_geo in dsc['geometry']:
-                    nuts_2_id = nuts_2_geo.coords['nuts_2'].values.item()
-                    df1 = pd.DataFrame(opsd_re_c.loc[opsd_re_c.within(nuts_2_geo.item())].groupby('energy_source_level_2').sum().electrical_capacity.rename(nuts_2_id)).T
-                    df1 = df1.fillna(0)
-                    for tech in ['Wind','Solar']:
-                        if tech in df1.columns:
-                            df_1[nuts_2_id,tech,tech] = df1.loc[nuts_2_id,tech]
+        opsd_re = opsd_re.loc[opsd_re.country.isin(ds.coords['nuts_0'].values)]
+        opsd_re['nuts_2'] = assign_nuts2(opsd_re, ds)
+        opsd_re = opsd_re.loc[opsd_re['nuts_2'].map(ds['country_code'].to_series()) == opsd_re.country]
+        re_capacity = opsd_re.groupby(['nuts_2','energy_source_level_2']).electrical_capacity.sum().unstack()
+        for nuts_2_id, df1 in re_capacity.iterrows():
+            for tech in ['Wind','Solar']:
+                if tech in df1.index and not np.isnan(df1[tech]):
+                    df_1[nuts_2_id,tech,tech] = df1[tech]
 
         for i in ['power_plants','tech','fuel']:
             if i in ds.data_vars or i in ds.coords:
@@ -81,7 +84,7 @@ class Power_Plants():
 
         # Add offshore wind farm
 
-        wind_offshore = gpd.read_file('https://ows.emodnet-humanactivities.eu/wfs?SERVICE=WFS&VERSION=1.1.0&request=GetFeature&typeName=windfarms&OUTPUTFORMAT=json')
+        wind_offshore = gpd.read_file(fetch_path('https://ows.emodnet-humanactivities.eu/wfs?SERVICE=WFS&VERSION=1.1.0&request=GetFeature&typeName=windfarms&OUTPUTFORMAT=json'))
 
         def poly_np(poly,turbine_point):
             poly_ext = LinearRing(poly.exterior.coords)
@@ -100,10 +103,9 @@ class Power_Plants():
                 ds = ds.drop(i)
         ds['power_plants'] = df.T.to_xarray()['power_plants']
 
-        for name in EUSES.countries:
+        for name in country_spans(EUSES.countries):
             nuts_0_id = pr.get_metadata(name,'nuts_id')
-            if name == 'Great Britain':
-                name = 'United Kingdom'
+            name = pr.source_id(name,'wind_farms','name')
 
             wind_off_filt = wind_offshore.query('country == "{}" & status == "Production"'.format(name)).to_crs({'init': 'epsg:3035'})
             for w in wind_off_filt.index:
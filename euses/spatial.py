@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+from rasterio import features, windows
+from shapely.geometry import box
+from shapely import wkb, wkt
+from pyproj import Geod
+from concurrent.futures import ProcessPoolExecutor
+
+
+def assign_nuts2(points, ds):
+    ''' Return the nuts_2 id of the area in which each point lies (NaN outside of all areas).
+        points: GeoDataFrame in the crs of ds['geometry']
+    '''
+    zones = gpd.GeoSeries(ds['geometry'].values)
+    query = getattr(zones.sindex, 'query_bulk', zones.sindex.query)
+    point_idx, zone_idx = query(points.geometry.values, predicate='within')
+
+    nuts_2 = pd.Series(np.nan, index=points.index, dtype=object, name='nuts_2')
+    # a point within several overlapping areas is assigned to the first one, a point on a border
+    # is within no area and stays NaN
+    _, first = np.unique(point_idx, return_index=True)
+    nuts_2.iloc[point_idx[first]] = ds.coords['nuts_2'].values[zone_idx[first]]
+    return nuts_2
+
+
+def adjacent_pairs(geometries, buffer=0.0001):
+    ''' Return the sorted (i, j) positions, i < j, of the geometries that intersect once buffered '''
+    buffered = gpd.GeoSeries(list(geometries)).buffer(buffer)
+    query = getattr(buffered.sindex, 'query_bulk', buffered.sindex.query)
+    i, j = query(buffered.values, predicate='intersects')
+    return sorted(zip(i[i < j].tolist(), j[i < j].tolist()))
+
+def geodesic_distance(from_points, to_points):
+    ''' Return the WGS84 geodesic distances in km between two arrays of (lon, lat) points '''
+    lons_1, lats_1 = np.array([p.x for p in from_points]), np.array([p.y for p in from_points])
+    lons_2, lats_2 = np.array([p.x for p in to_points]), np.array([p.y for p in to_points])
+    _, _, meters = Geod(ellps='WGS84').inv(lons_1, lats_1, lons_2, lats_2)
+    return np.asarray(meters) / 1e3
+
+
+def _raster_window(src, bounds):
+    col_min, row_min = ~src.transform * (bounds[0], bounds[3])
+    col_max, row_max = ~src.transform * (bounds[2], bounds[1])
+    col_min, row_min = max(int(np.floor(col_min)), 0), max(int(np.floor(row_min)), 0)
+    col_max, row_max = min(int(np.ceil(col_max)), src.width), min(int(np.ceil(row_max)), src.height)
+    return col_min, row_min, max(col_max - col_min, 0), max(row_max - row_min, 0)
+
+def _zonal_tile(raster_path, shapes, window, n_zones):
+    with rasterio.open(raster_path) as src:
+        data = src.read(1, window=window, masked=True)
+        transform = src.window_transform(window)
+    sums = np.zeros(n_zones + 1)
+    counts = np.zeros(n_zones + 1, dtype='int64')
+    if len(shapes) == 0 or data.size == 0:
+        return sums[1:], counts[1:]
+    labels = features.rasterize(shapes, out_shape=data.shape, transform=transform, fill=0, dtype='int32')
+    valid = (labels > 0) & ~np.ma.getmaskarray(data)
+    values = data.data[valid].astype('float64')
+    labels = labels[valid][~np.isnan(values)]
+    values = values[~np.isnan(values)]
+    sums += np.bincount(labels, weights=values, minlength=n_zones + 1)
+    counts += np.bincount(labels, minlength=n_zones + 1)
+    return sums[1:], counts[1:]
+
+def zonal_stats_batch(geometries, raster_path, stats=['sum'], processes=None, tile_rows=2048):
+    ''' Return a DataFrame with the stats ('sum', 'count') of the raster cells within each geometry.
+        The raster is opened once and read tile by tile, all geometries are rasterized into a label grid.
+        geometries: list of geometries in the crs of the raster
+        processes: number of worker processes among which the raster tiles are split
+    '''
+    geometries = list(geometries)
+    n_zones = len(geometries)
+    bounds = gpd.GeoSeries(geometries).total_bounds
+
+    tiles = []
+    with rasterio.open(raster_path) as src:
+        col_off, row_off, width, height = _raster_window(src, bounds)
+        for row in range(row_off, row_off + height, tile_rows):
+            window = windows.Window(col_off, row, width, min(tile_rows, row_off + height - row))
+            tile_bounds = box(*windows.bounds(window, src.transform))
+            shapes = [(geo, label + 1) for label, geo in enumerate(geometries)
+                      if geo is not None and geo.intersects(tile_bounds)]
+            tiles.append((raster_path, shapes, window, n_zones))
+
+    if processes is not None and processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_zonal_tile, *zip(*tiles)))
+    else:
+        results = [_zonal_tile(*tile) for tile in tiles]
+
+    sums = np.sum([r[0] for r in results], axis=0) if results else np.zeros(n_zones)
+    counts = np.sum([r[1] for r in results], axis=0) if results else np.zeros(n_zones, dtype='int64')
+
+    df = pd.DataFrame(index=range(n_zones))
+    if 'sum' in stats:
+        # same as rasterstats, no sum for geometries without cells
+        df['sum'] = np.where(counts > 0, sums, np.nan)
+    if 'count' in stats:
+        df['count'] = counts
+    return df
+
+
+def encode_geometry(ds, var='geometry'):
+    ''' Return a copy of ds with the geometries of var stored as WKB bytes in one flat buffer:
+        var_wkb holds the bytes of all geometries, var_offsets the end of each geometry in the buffer
+    '''
+    dim = ds[var].dims[0]
+    buffers = [wkb.dumps(geo) for geo in ds[var].values]
+    offsets = np.cumsum([len(b) for b in buffers]).astype('int64')
+    dsc = ds.drop_vars(var)
+    dsc[var + '_wkb'] = ((var + '_bytes'), np.frombuffer(b''.join(buffers), dtype='uint8'), ds[var].attrs)
+    dsc[var + '_offsets'] = ((dim), offsets)
+    return dsc
+
+def decode_geometry(ds, var='geometry'):
+    ''' Inverse of encode_geometry, datasets saved with WKT strings are also read '''
+    if var + '_wkb' in ds.variables:
+        buffer = ds[var + '_wkb'].values.tobytes()
+        offsets = ds[var + '_offsets']
+        starts = np.concatenate([[0], offsets.values[:-1]])
+        geometries = [wkb.loads(buffer[i:j]) for i, j in zip(starts, offsets.values)]
+        attrs = ds[var + '_wkb'].attrs
+        ds = ds.drop_vars([var + '_wkb', var + '_offsets'])
+        ds[var] = ((offsets.dims[0]), np.array(geometries, dtype=object), attrs)
+    elif var in ds.variables and isinstance(ds[var].values.flat[0], str):
+        ds[var] = (ds[var].dims, np.array([wkt.loads(geo) for geo in ds[var].values], dtype=object), ds[var].attrs)
+    return ds
@@ -0,0 +1,73 @@
+import os
+import itertools
+import pandas as pd
+import xarray as xr
+from concurrent.futures import ProcessPoolExecutor
+
+def scenario_grid(countries, methods=['poli_regions'], sectors=[['power','heat']], co2_cap_factors=[None], demand_scalings=[{}],
+                  regions_kwargs=[{}]):
+    '''
+    Return the list of scenarios of the grid, every combination of
+    countries : list of lists of countries by name
+    methods : list of create_regions methods
+    sectors : list of lists of sectors
+    co2_cap_factors : list of co2_cap_factor
+    demand_scalings : list of dictionaries of factors by variable of the dataset, e.g. {'industries_demand':0}
+    regions_kwargs : list of dictionaries of create_regions arguments, e.g. {'area_factor':2, 'seeds':[1,2,3]},
+                     max_p_regions and rdm_regions need an area_factor
+    '''
+    keys = ['countries', 'method', 'sectors', 'co2_cap_factor', 'demand_scaling', 'regions_kwargs']
+    scenarios = [dict(zip(keys, values)) for values in itertools.product(countries, methods, sectors, co2_cap_factors,
+                                                                         demand_scalings, regions_kwargs)]
+    for scenario in scenarios:
+        if scenario['method'] in ['max_p_regions', 'rdm_regions'] and scenario['regions_kwargs'].get('area_factor') is None:
+            raise ValueError('{} scenarios need an area_factor in regions_kwargs'.format(scenario['method']))
+    return scenarios
+
+def run_scenario(dataset, scenario, model_dir, op_mode='plan', national=False, n_days=None,
+                 calliope_scenario=None, override_dict=None, results=['energy_cap']):
+    ''' Build, write to model_dir and solve the calliope model of one scenario of scenario_grid.
+        dataset: EUSES dataset of the countries of the scenario
+        Returns a Dataset with the formatted arrays listed in results
+    '''
+    import calliope
+
+    for var, factor in scenario['demand_scaling'].items():
+        dataset.ds[var] = dataset.ds[var] * factor
+    dataset.create_regions(scenario['method'], **scenario.get('regions_kwargs', {}))
+    dataset.create_calliope_model(op_mode=op_mode, sectors=scenario['sectors'], co2_cap_factor=scenario['co2_cap_factor'],
+                                  national=national, n_days=n_days, model_dir=model_dir)
+    model = calliope.Model(os.path.join(model_dir, 'model.yaml'), scenario=calliope_scenario, override_dict=override_dict)
+    model.run()
+    model.to_netcdf(os.path.join(model_dir, 'results.nc'))
+    return xr.Dataset({var: model.get_formatted_array(var) for var in results})
+
+def _run_scenario(args):
+    dataset, scenario, model_dir, kwargs = args
+    return run_scenario(dataset, scenario, model_dir, **kwargs)
+
+def sweep(dataset, scenarios, base_dir='sweep', max_workers=2, **kwargs):
+    '''
+    Solve the scenarios of scenario_grid on a pool of max_workers processes.
+    Each scenario is written to its own folder base_dir/scenario_<i>.
+    kwargs are passed to run_scenario (op_mode, national, n_days, calliope_scenario, override_dict, results)
+    Returns the results of all scenarios concatenated along the scenario dimension,
+    with the parameters of each scenario as coordinates
+    '''
+    tasks = []
+    for i, scenario in enumerate(scenarios):
+        # only the countries of the scenario are sent to the worker
+        tasks.append((dataset.filter_countries(scenario['countries']), scenario,
+                      os.path.join(base_dir, 'scenario_{}'.format(i)), kwargs))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(_run_scenario, tasks))
+
+    ds = xr.concat(results, dim=pd.Index(range(len(scenarios)), name='scenario'), join='outer')
+    ds.coords['countries'] = ('scenario', [','.join(s['countries']) for s in scenarios])
+    ds.coords['method'] = ('scenario', [s['method'] for s in scenarios])
+    ds.coords['sectors'] = ('scenario', [','.join(s['sectors']) for s in scenarios])
+    ds.coords['co2_cap_factor'] = ('scenario', [float('nan') if s['co2_cap_factor'] is None else s['co2_cap_factor'] for s in scenarios])
+    ds.coords['demand_scaling'] = ('scenario', [str(s['demand_scaling']) for s in scenarios])
+    ds.coords['regions_kwargs'] = ('scenario', [str(s.get('regions_kwargs', {})) for s in scenarios])
+    return ds
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+from scipy.cluster.hierarchy import linkage, fcluster
+
+cluster_variables = ['power', 'heat', 'hydrogen', 'pv_cf', 'wind_cf', 'wind_offshore_cf', 'cop_air']
+
+def daily_features(ds_regions, variables=cluster_variables):
+    ''' Return the days and a (days x features) array of the variables (regions, time) scaled by their maximum,
+        each feature is one time step of the day in one region
+    '''
+    times = pd.DatetimeIndex(ds_regions.coords['time'].values)
+    days = times.normalize().unique()
+    steps = len(times) // len(days)
+    features = []
+    for var in variables:
+        if var not in ds_regions.data_vars or set(ds_regions[var].dims) != {'regions', 'time'}:
+            continue
+        values = np.nan_to_num(ds_regions[var].transpose('time', 'regions').values[:len(days)*steps].astype('float64'))
+        scale = np.abs(values).max()
+        if scale > 0:
+            values = values / scale
+        features.append(values.reshape(len(days), -1))
+    return days, np.concatenate(features, axis=1)
+
+def cluster_days(ds_regions, n_days, variables=cluster_variables):
+    ''' Cluster the days of the year jointly on the variables with Ward's method.
+        Returns the cluster of each day, numbered in order of first appearance.
+        The series is the ordering of the clusters for the storage between clusters.
+    '''
+    days, features = daily_features(ds_regions, variables)
+    labels = fcluster(linkage(features, method='ward'), n_days, criterion='maxclust')
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    order = np.argsort(np.argsort(first))
+    return pd.Series(order[inverse], index=days, name='cluster')
@@ -1,12 +1,204 @@
 import requests
+import numpy as np
 import pandas as pd
+import xarray as xr
 import io
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, quote
 
-def download_re_ninja(year,country_id, data_type):
-    ''' data_type: "weather", "pv", "wind", "wind_offshore"
+from .instrumentation import count_download
+
+# Local cache of the remote data sources. The settings can be changed with
+# set_cache or with the EUSES_CACHE_DIR, EUSES_CACHE_MAX_SIZE (bytes),
+# EUSES_CACHE_MIRROR and EUSES_OFFLINE environment variables.
+cache_settings = {
+    'dir': os.environ.get('EUSES_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'euses')),
+    'max_size': float(os.environ.get('EUSES_CACHE_MAX_SIZE', 20e9)),
+    'mirror': os.environ.get('EUSES_CACHE_MIRROR'),
+    'offline': os.environ.get('EUSES_OFFLINE', '').lower() in ['1', 'true', 'yes'],
+}
+
+_cache_lock = threading.RLock()
+
+def set_cache(directory=None, max_size=None, mirror=None, offline=None):
+    ''' directory: folder of the download cache
+        max_size: maximum size of the cache in bytes, least recently used downloads are evicted first
+        mirror: pre-seeded folder with the files stored as <host>/<path>
+        offline: if True, only the cache and the mirror are used
+    '''
+    for k, v in zip(['dir', 'max_size', 'mirror', 'offline'], [directory, max_size, mirror, offline]):
+        if v is not None:
+            cache_settings[k] = v
+    return cache_settings
+
+def _read_index():
+    path = os.path.join(cache_settings['dir'], 'index.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
+
+def _write_index(index):
+    path = os.path.join(cache_settings['dir'], 'index.json')
+    with tempfile.NamedTemporaryFile('w', dir=cache_settings['dir'], delete=False) as f:
+        json.dump(index, f)
+    os.replace(f.name, path)
+
+def _blob_path(entry):
+    return os.path.join(cache_settings['dir'], 'blobs', entry['sha256'] + entry['ext'])
+
+def mirror_path(url, mirror):
+    ''' Path of url in a mirror folder: <host>/<path>, followed by __<quoted query> for urls with a query '''
+    parsed = urlparse(url)
+    path = os.path.join(mirror, parsed.netloc, parsed.path.lstrip('/'))
+    if parsed.query:
+        path += '__' + quote(parsed.query, safe='')
+    return path
+
+def _mirror_path(url):
+    if cache_settings['mirror'] is None:
+        return None
+    path = mirror_path(url, cache_settings['mirror'])
+    if os.path.isfile(path):
+        return path
+    return None
+
+def _evict(index):
+    ''' Remove least recently used downloads until the cache fits in max_size '''
+    total = sum(dict((e['sha256'], e['size']) for e in index.values()).values())
+    for url, entry in sorted(index.items(), key=lambda i: i[1]['accessed']):
+        if total <= cache_settings['max_size']:
+            break
+        del index[url]
+        if entry['sha256'] not in [e['sha256'] for e in index.values()]:
+            if os.path.exists(_blob_path(entry)):
+                os.remove(_blob_path(entry))
+            total -= entry['size']
+
+def _large_downloads_dir():
+    return os.path.join(tempfile.gettempdir(), 'euses-large-downloads')
+
+def fetch_path(url, refresh=False):
+    ''' Return a local path with the content of url.
+        The download is stored in the cache keyed by url and content hash. Downloads larger than the
+        maximum size of the cache are stored in <temporary folder>/euses-large-downloads, removed by clear_cache.
     '''
-    url_base = 'https://www.renewables.ninja/country_downloads/'
+    with _cache_lock:
+        os.makedirs(os.path.join(cache_settings['dir'], 'blobs'), exist_ok=True)
+        index = _read_index()
+        entry = index.get(url)
+        if entry is not None and not refresh and os.path.exists(_blob_path(entry)):
+            entry['accessed'] = time.time()
+            _write_index(index)
+            return _blob_path(entry)
+
+    mirror_file = _mirror_path(url)
+    if mirror_file is not None and not refresh:
+        return mirror_file
+
+    if cache_settings['offline']:
+        raise FileNotFoundError('{} is not in the cache {} (offline mode)'.format(url, cache_settings['dir']))
+
+    r = requests.get(url, stream=True)
+    r.raise_for_status()
+    sha256 = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile('wb', dir=cache_settings['dir'], delete=False) as f:
+        for chunk in r.iter_content(chunk_size=1 << 20):
+            sha256.update(chunk)
+            size += len(chunk)
+            f.write(chunk)
+    count_download(size)
+
+    entry = {'sha256': sha256.hexdigest(), 'ext': os.path.splitext(urlparse(url).path)[1],
+             'size': size, 'accessed': time.time()}
+    if size > cache_settings['max_size']:
+        # larger than the cache, the download is kept outside of the cache in one temporary folder,
+        # by content hash so that the next downloads of the file replace it
+        path = os.path.join(_large_downloads_dir(), os.path.basename(_blob_path(entry)))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(f.name, path)
+        return path
+
+    with _cache_lock:
+        index = _read_index()
+        os.replace(f.name, _blob_path(entry))
+        index[url] = entry
+        _evict(index)
+        _write_index(index)
+        return _blob_path(entry)
+
+def fetch(url, refresh=False):
+    ''' Return the content of url as bytes '''
+    with open(fetch_path(url, refresh), 'rb') as f:
+        return f.read()
 
+def clear_cache():
+    with _cache_lock:
+        for path in [cache_settings['dir'], _large_downloads_dir()]:
+            if os.path.exists(path):
+                shutil.rmtree(path)
+
+entsoe_load_url = 'https://eepublicdownloads.blob.core.windows.net/public-cdn-container/clean-documents/Publications/Statistics/Monthly-hourly-load-values_2006-2015.xlsx'
+
+def _entsoe_load_array(path):
+    load_excel = pd.read_excel(path, header=3)
+    hours = load_excel.drop(['Country','Year','Month','Day','Coverage ratio'], axis=1)
+    keys = pd.MultiIndex.from_frame(load_excel[['Country','Year']])
+    n_days = keys.value_counts().max()
+    # days of each (country, year) in the order of the workbook, padded with NaN
+    day = load_excel.groupby(['Country','Year']).cumcount().values
+    values = np.full((len(keys.unique()), n_days, hours.shape[1]), np.nan)
+    values[keys.unique().get_indexer(keys), day] = hours.values.astype('float64')
+    return xr.DataArray(values.reshape(len(keys.unique()), -1), dims=('key','hour'),
+                        coords={'key': keys.unique(), 'hour': range(values.shape[1]*values.shape[2])}, name='load').unstack('key')
+
+_entsoe_lock = threading.Lock()
+_entsoe_stores = {}
+
+def _content_key(path):
+    ''' sha256 of a file of fetch_path, read from the name of the cache blobs '''
+    if os.path.dirname(path) == os.path.join(cache_settings['dir'], 'blobs'):
+        return os.path.splitext(os.path.basename(path))[0]
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def entsoe_load_store(url=entsoe_load_url, refresh=False):
+    ''' Hourly load in MW of the ENTSO-E workbook as a DataArray indexed by Country, Year and hour of the year.
+        The workbook is converted once and the store is kept in the cache folder, keyed by the hash of the workbook.
+        The store is then kept in memory by url, until refresh.
+    '''
+    with _entsoe_lock:
+        if url in _entsoe_stores and not refresh:
+            return _entsoe_stores[url]
+        path = fetch_path(url, refresh)
+        store_path = os.path.join(cache_settings['dir'], 'stores', 'entsoe_load-{}.nc'.format(_content_key(path)[:16]))
+        if os.path.exists(store_path):
+            _entsoe_stores[url] = xr.load_dataarray(store_path)
+        else:
+            os.makedirs(os.path.dirname(store_path), exist_ok=True)
+            _entsoe_stores[url] = _entsoe_load_array(path)
+            _entsoe_stores[url].to_netcdf(store_path + '.tmp')
+            os.replace(store_path + '.tmp', store_path)
+        return _entsoe_stores[url]
+
+def entsoe_load(country_id, year, hours, url=entsoe_load_url):
+    ''' Hourly load in MW of a country for the first hours of the year, missing values filled with the mean '''
+    load = entsoe_load_store(url).sel(Country=country_id, Year=year).values[:hours]
+    return np.where(np.isnan(load), np.nanmean(load), load)
+
+def re_ninja_url(country_id, data_type, url_base='https://www.renewables.ninja/country_downloads/'):
+    ''' data_type: "weather", "pv", "wind", "wind_offshore"
+    '''
     url_dic = {'weather' : '{}/ninja_weather_country_{}_merra-2_land_area_weighted.csv',
                'pv' : '{}/ninja_pv_country_{}_merra-2_nuts-2_corrected.csv',
                'wind' : '{}/ninja_wind_country_{}_current_merra-2_nuts-2_corrected.csv',
@@ -20,10 +212,43 @@ def download_re_ninja(year,country_id, data_type):
 
     url_data = url_dic.get(data_type)
 
-    url = url_base + url_data.format(country_id,country_id)
+    return url_base + url_data.format(country_id,country_id)
 
-    r1 = requests.get(url)
+def _read_re_ninja(url, year):
+    df = pd.read_csv(io.BytesIO(fetch(url)), header=2, index_col=0)
+    if year is not None:
+        df = df[str(year):str(year+1)]
+    return df
 
-    df = pd.read_csv(io.StringIO(r1.text), header=2, index_col=0)[str(year):str(year+1)]
+async def _download_re_ninja_async(pairs, year, max_concurrency, url_base):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    urls = {pair: re_ninja_url(*pair, url_base=url_base) for pair in pairs}
 
-    return df
+    async def download(url):
+        async with semaphore:
+            # the downloads are counted in the stage of the caller
+            return url, await loop.run_in_executor(None, contextvars.copy_context().run, _read_re_ninja, url, year)
+
+    # every file is downloaded and parsed once, even if requested for several pairs
+    frames = dict(await asyncio.gather(*[download(url) for url in set(urls.values())]))
+    return {pair: frames[url] for pair, url in urls.items()}
+
+def download_re_ninja_batch(pairs, year=None, max_concurrency=8, url_base='https://www.renewables.ninja/country_downloads/'):
+    ''' Download the renewables.ninja series of several (country_id, data_type) pairs concurrently.
+        year: if None, the series of all years are returned
+        Returns a dictionary of DataFrames by (country_id, data_type)
+    '''
+    coroutine = _download_re_ninja_async(list(pairs), year, max_concurrency, url_base)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    # an event loop is already running in this thread (e.g. jupyter)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coroutine).result()
+
+def download_re_ninja(year,country_id, data_type):
+    ''' data_type: "weather", "pv", "wind", "wind_offshore"
+    '''
+    return download_re_ninja_batch([(country_id, data_type)], year)[(country_id, data_type)]